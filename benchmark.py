@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# benchmark.py - Benchmarks de desempenho do reconhecimento
+import argparse
+import contextlib
+import io
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
+from face_matcher import FaceMatcher
+from face_index import IVFIndex
+from gallery import compact_gallery, METHODS
+from face_tracker import box_iou
+from model_store import open_model, write_model
+from database import Database
+from create_database import create_database
+from config import config
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def synthetic_gallery(n_people, per_person, n_queries, seed=0, poses=0, with_labels=False):
+    """Galeria sintética com estatísticas parecidas às dos encodings reais
+
+    Distância entre pessoas ~0.9 e dentro da mesma pessoa ~0.4. Com poses > 0
+    cada pessoa tem esse número de sub-centros (poses/iluminação) e cada
+    encoding ou query sai de um deles. Com with_labels devolve também a
+    pessoa de cada query.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 0.056, (n_people, 128))
+    labels = np.repeat(np.arange(n_people), per_person)
+    query_labels = None
+    if poses:
+        pose_offsets = rng.normal(0, 0.02, (n_people, poses, 128))
+        encodings = (centers[labels] + pose_offsets[labels, rng.integers(0, poses, len(labels))]
+                     + rng.normal(0, 0.02, (len(labels), 128)))
+        query_labels = rng.integers(0, n_people, n_queries)
+        queries = (centers[query_labels] + pose_offsets[query_labels, rng.integers(0, poses, n_queries)]
+                   + rng.normal(0, 0.02, (n_queries, 128)))
+    else:
+        encodings = centers[labels] + rng.normal(0, 0.025, (len(labels), 128))
+    names = [f"pessoa_{label}" for label in labels]
+
+    if query_labels is None:
+        query_labels = rng.integers(0, n_people, n_queries)
+        queries = centers[query_labels] + rng.normal(0, 0.025, (n_queries, 128))
+    if with_labels:
+        return encodings, names, queries, [f"pessoa_{label}" for label in query_labels]
+    return encodings, names, queries
+
+
+def load_gallery(model_path, n_queries, seed=0, with_labels=False):
+    """Usar encodings de um modelo real; queries são encodings do modelo com ruído"""
+    matcher, _ = open_model(model_path, use_mmap=False)
+    encodings = np.asarray(matcher.encodings)
+    rng = np.random.default_rng(seed)
+    picked = rng.integers(0, len(encodings), n_queries)
+    queries = encodings[picked] + rng.normal(0, 0.02, (n_queries, 128))
+    if with_labels:
+        names = matcher.names
+        return encodings, names, queries, [names[i] for i in picked]
+    return encodings, matcher.names, queries
+
+
+def timed(func, repeat):
+    """Tempo médio por chamada em milissegundos"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def bench_ann(args):
+    """Recall@k e latência do índice IVF contra a pesquisa exata"""
+    if args.model:
+        encodings, names, queries = load_gallery(args.model, args.queries)
+    else:
+        encodings, names, queries = synthetic_gallery(args.people, args.per_person, args.queries)
+
+    matcher = FaceMatcher(encodings, names)
+    print(f"📊 Galeria: {len(matcher)} encodings, {len(matcher.label_names)} pessoas, {len(queries)} queries")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(matcher.encodings, matcher.sq_norms, n_lists=args.n_lists or None)
+    print(f"🗂️ Índice construído em {time.perf_counter() - start:.2f}s ({index.n_lists} listas)")
+
+    # Referência exata (uma query de cada vez, como no reconhecimento)
+    exact_ms = 0.0
+    exact_ids = []
+    for query in queries:
+        ms, (idx, _) = timed(lambda: matcher.top_k(matcher.distance_matrix(query), args.k), 1)
+        exact_ms += ms
+        exact_ids.append(set(idx[0].tolist()))
+    print(f"\n{'modo':<28}{'recall@' + str(args.k):>10}{'ms/query':>12}")
+    print(f"{'exato':<28}{1.0:>10.3f}{exact_ms / len(queries):>12.3f}")
+
+    for n_probe in args.n_probe:
+        for rerank in args.rerank:
+            total_ms = 0.0
+            hits = 0
+            for query, expected in zip(queries, exact_ids):
+                ms, (idx, _) = timed(lambda: index.search(matcher, query, args.k, n_probe=n_probe, rerank=rerank), 1)
+                total_ms += ms
+                hits += len(expected & set(idx[0].tolist()))
+            recall = hits / (len(queries) * min(args.k, len(matcher)))
+            label = f"ivf probe={n_probe} rerank={rerank}"
+            print(f"{label:<28}{recall:>10.3f}{total_ms / len(queries):>12.3f}")
+
+
+def bench_gallery(args):
+    """Precisão e latência da galeria compactada em protótipos vs galeria completa"""
+    if args.model:
+        encodings, names, queries, expected = load_gallery(args.model, args.queries, with_labels=True)
+    else:
+        encodings, names, queries, expected = synthetic_gallery(
+            args.people, args.per_person, args.queries, poses=args.poses, with_labels=True)
+    expected = np.asarray(expected, dtype=object)
+
+    full = FaceMatcher(encodings, names)
+    max_distance = 1 - config.CONFIDENCE_THRESHOLD
+    print(f"📊 Galeria: {len(full)} encodings, {len(full.label_names)} pessoas, {len(queries)} queries")
+    print(f"\n{'galeria':<22}{'linhas':>9}{'MB':>8}{'top-1':>8}{'aceites':>9}{'≠ completa':>12}{'ms/query':>10}{'ms/lote':>9}")
+
+    reference = None
+    for n_prototypes in [0] + args.prototypes:
+        for method in (['-'] if n_prototypes == 0 else args.method):
+            if n_prototypes == 0:
+                matcher, label = full, 'completa'
+            else:
+                matcher = compact_gallery(full, n_prototypes, method)
+                label = f"{method} k={n_prototypes}"
+
+            single_ms = sum(timed(lambda: matcher.match(query), 1)[0] for query in queries[:args.latency_queries])
+            single_ms /= min(len(queries), args.latency_queries)
+            batch_ms, results = timed(lambda: matcher.match(queries), 3)
+
+            predicted = np.asarray([r['name'] for r in results], dtype=object)
+            distances = np.asarray([r['distance'] for r in results])
+            top1 = np.mean(predicted == expected)
+            # Aceite = pessoa certa e abaixo do limiar de confiança do reconhecimento
+            accepted = np.mean((predicted == expected) & (distances < max_distance))
+            if reference is None:
+                reference = predicted
+            changed = np.mean(predicted != reference)
+
+            print(f"{label:<22}{len(matcher):>9}{matcher.encodings.nbytes / 1e6:>8.2f}{top1:>8.3f}{accepted:>9.3f}"
+                  f"{changed:>12.3f}{single_ms:>10.3f}{batch_ms:>9.2f}")
+
+
+def bench_load(args):
+    """Tempo de arranque: abrir modelo pickle vs binário (mmap) e primeira pesquisa"""
+    if args.model:
+        encodings, names, _ = load_gallery(args.model, 1)
+    else:
+        encodings, names, _ = synthetic_gallery(args.people, args.per_person, 1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pickle_path = os.path.join(tmp_dir, 'model.pkl')
+        binary_path = os.path.join(tmp_dir, 'model.bin')
+
+        # Modelo pickle no formato antigo (lista de arrays float64)
+        with open(pickle_path, 'wb') as f:
+            pickle.dump({'encodings': [np.asarray(e, dtype=np.float64) for e in encodings], 'names': list(names)}, f)
+        write_model(binary_path, FaceMatcher(encodings, names))
+
+        print(f"📊 Modelo: {len(encodings)} encodings")
+        print(f"   pickle: {os.path.getsize(pickle_path) / 1e6:.1f} MB, binário: {os.path.getsize(binary_path) / 1e6:.1f} MB")
+        print(f"\n{'formato':<20}{'abrir (ms)':>12}{'1ª query (ms)':>15}")
+
+        query = np.asarray(encodings[0])
+        for label, path, use_mmap in (('pickle', pickle_path, False),
+                                      ('binário (mmap)', binary_path, True),
+                                      ('binário (memória)', binary_path, False)):
+            open_ms, (matcher, _) = timed(lambda: open_model(path, use_mmap=use_mmap), args.repeat)
+            query_ms, _ = timed(lambda: matcher.match(query), 1)
+            print(f"{label:<20}{open_ms:>12.2f}{query_ms:>15.2f}")
+            del matcher
+
+
+def list_images(folder):
+    """Todas as imagens de uma pasta (recursivo), por ordem"""
+    paths = []
+    for root, _, files in os.walk(folder):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+
+def bench_detect(args):
+    """Latência vs precisão da deteção HOG com redução prévia da imagem"""
+    import face_recognition
+    from face_recognizer import downscale_for_detection, scale_face_location
+
+    paths = list_images(args.images)
+    if not paths:
+        print(f"❌ Nenhuma imagem em {args.images}")
+        return
+
+    # Resolução original (0) é sempre a referência
+    settings = [0] + [side for side in args.max_side if side != 0]
+    stats = {side: {'ms': 0.0, 'faces': 0, 'matched': 0, 'drift': []} for side in settings}
+
+    for path in paths:
+        image = face_recognition.load_image_file(path)
+        reference = None
+        reference_encodings = None
+
+        for side in settings:
+            start = time.perf_counter()
+            small, factor = downscale_for_detection(image, max_side=side, scale=1.0)
+            locations = [scale_face_location(loc, factor, image.shape)
+                         for loc in face_recognition.face_locations(small, model="hog")]
+            stats[side]['ms'] += (time.perf_counter() - start) * 1000
+            stats[side]['faces'] += len(locations)
+
+            if side == 0:
+                reference = locations
+                reference_encodings = face_recognition.face_encodings(image, reference)
+                stats[side]['matched'] += len(locations)
+                continue
+
+            # Faces da referência encontradas (IoU >= 0.5) e desvio do encoding
+            for ref_box, ref_encoding in zip(reference, reference_encodings):
+                best = max(locations, key=lambda box: box_iou(ref_box, box), default=None)
+                if best is not None and box_iou(ref_box, best) >= 0.5:
+                    stats[side]['matched'] += 1
+                    encoding = face_recognition.face_encodings(image, [best])[0]
+                    stats[side]['drift'].append(float(np.linalg.norm(encoding - ref_encoding)))
+
+    total_ref = stats[0]['faces']
+    print(f"📊 {len(paths)} imagens, {total_ref} faces na resolução original")
+    print(f"\n{'max_side':<10}{'ms/imagem':>11}{'speedup':>9}{'faces':>7}{'recall':>8}{'desvio enc.':>13}")
+    for side in settings:
+        s = stats[side]
+        ms = s['ms'] / len(paths)
+        recall = s['matched'] / total_ref if total_ref else 1.0
+        drift = f"{np.mean(s['drift']):.4f}" if s['drift'] else '-'
+        label = side or 'original'
+        print(f"{label:<10}{ms:>11.1f}{stats[0]['ms'] / max(s['ms'], 1e-9):>8.1f}x{s['faces']:>7}{recall:>8.3f}{drift:>13}")
+
+def _insert_detection(cursor, thread_id, i):
+    """Escrita típica do reconhecimento: procurar a pessoa e inserir a detecção"""
+    name = f"pessoa_{i % 50}"
+    cursor.execute("SELECT id FROM people WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    cursor.execute("""
+        INSERT INTO detections (image_path, detected_person_id, detected_name, confidence_score,
+                                timestamp, source, is_verified, face_location)
+        VALUES (?, ?, ?, ?, ?, 'benchmark', FALSE, ?)
+    """, (f"img_{thread_id}_{i}.jpg", row[0] if row else None, name, 0.8,
+          time.strftime('%Y-%m-%dT%H:%M:%S'), "10,60,60,10"))
+
+
+def bench_db(args):
+    """Escritas concorrentes de detecções: ligação por escrita (antes) vs pool + WAL"""
+    def connect_per_write(path):
+        def write(thread_id, i):
+            conn = sqlite3.connect(path, timeout=args.timeout)
+            try:
+                _insert_detection(conn.cursor(), thread_id, i)
+                conn.commit()
+            finally:
+                conn.close()
+        return write, None
+
+    def pooled(path):
+        db = Database(path, pool_size=args.threads, busy_timeout_ms=args.timeout * 1000)
+        return (lambda thread_id, i: db.transaction(_insert_detection, thread_id, i)), db
+
+    print(f"📊 {args.threads} threads x {args.writes} detecções")
+    print(f"\n{'modo':<26}{'detecções/s':>13}{'erros':>7}{'ms/escrita':>12}")
+
+    for label, factory, wal in (('ligação por escrita', connect_per_write, False),
+                                ('pool + WAL', pooled, True)):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'bench.db')
+            with contextlib.redirect_stdout(io.StringIO()):
+                create_database(path)
+            conn = sqlite3.connect(path)
+            if not wal:
+                # Modo de journal por omissão de uma base de dados antiga
+                conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executemany("INSERT INTO people (name, face_encoding) VALUES (?, ?)",
+                             [(f"pessoa_{i}", b'') for i in range(50)])
+            conn.commit()
+            conn.close()
+
+            write, db = factory(path)
+            errors = []
+            latencies = []
+
+            def worker(thread_id):
+                for i in range(args.writes):
+                    start = time.perf_counter()
+                    try:
+                        write(thread_id, i)
+                    except sqlite3.OperationalError as e:
+                        errors.append(e)
+                    latencies.append(time.perf_counter() - start)
+
+            threads = [threading.Thread(target=worker, args=(t,)) for t in range(args.threads)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            if db:
+                db.close()
+
+            written = args.threads * args.writes - len(errors)
+            print(f"{label:<26}{written / elapsed:>13.0f}{len(errors):>7}{np.mean(latencies) * 1000:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do sistema de reconhecimento facial")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ann = subparsers.add_parser('ann', help="Índice ANN (IVF) vs pesquisa exata")
+    ann.add_argument('--model', help="Modelo a usar em vez da galeria sintética")
+    ann.add_argument('--people', type=int, default=2000)
+    ann.add_argument('--per-person', type=int, default=50)
+    ann.add_argument('--queries', type=int, default=200)
+    ann.add_argument('--k', type=int, default=1)
+    ann.add_argument('--n-lists', type=int, default=0)
+    ann.add_argument('--n-probe', type=int, nargs='+', default=[1, 4, 8, 16])
+    ann.add_argument('--rerank', type=int, nargs='+', default=[0, 64])
+    ann.set_defaults(func=bench_ann)
+
+    gallery = subparsers.add_parser('gallery', help="Galeria compactada em protótipos vs galeria completa")
+    gallery.add_argument('--model', help="Modelo a usar em vez da galeria sintética")
+    gallery.add_argument('--people', type=int, default=500)
+    gallery.add_argument('--per-person', type=int, default=60)
+    gallery.add_argument('--poses', type=int, default=4, help="Sub-centros por pessoa na galeria sintética")
+    gallery.add_argument('--queries', type=int, default=1000)
+    gallery.add_argument('--latency-queries', type=int, default=200, help="Queries usadas na latência individual")
+    gallery.add_argument('--prototypes', type=int, nargs='+', default=[1, 3, 5, 8])
+    gallery.add_argument('--method', nargs='+', choices=METHODS, default=['kmeans', 'medoids'])
+    gallery.set_defaults(func=bench_gallery)
+
+    load = subparsers.add_parser('load', help="Tempo de abertura do modelo: pickle vs binário")
+    load.add_argument('--model', help="Modelo a usar em vez da galeria sintética")
+    load.add_argument('--people', type=int, default=1000)
+    load.add_argument('--per-person', type=int, default=20)
+    load.add_argument('--repeat', type=int, default=5)
+    load.set_defaults(func=bench_load)
+
+    detect = subparsers.add_parser('detect', help="Deteção com redução prévia vs resolução original")
+    detect.add_argument('--images', required=True, help="Pasta com imagens locais")
+    detect.add_argument('--max-side', type=int, nargs='+', default=[640, 960, 1280, 1600])
+    detect.set_defaults(func=bench_detect)
+
+    db = subparsers.add_parser('db', help="Escritas concorrentes na base de dados: antes vs pool + WAL")
+    db.add_argument('--threads', type=int, default=8)
+    db.add_argument('--writes', type=int, default=250, help="Detecções por thread")
+    db.add_argument('--timeout', type=float, default=5.0, help="Espera máxima por um lock (s)")
+    db.set_defaults(func=bench_db)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,9 @@ class Config:
     
     # Database Configuration
     DB_PATH = os.getenv('DB_PATH', 'face_recognition.db')
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+    DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+    DB_MAX_RETRIES = int(os.getenv('DB_MAX_RETRIES', 3))
     
     # Web Server Configuration
     FLASK_HOST = os.getenv('FLASK_HOST', '0.0.0.0')
@@ -19,19 +22,78 @@ class Config:
     
     # Paths Configuration
     IMAGES_BASE_PATH = os.getenv('IMAGES_BASE_PATH', 'test_images')
-    MODEL_PATH = os.getenv('MODEL_PATH', 'models/face_model.pkl')
+    MODEL_PATH = os.getenv('MODEL_PATH', 'models/face_model.bin')
+    TRAINING_CACHE_PATH = os.getenv('TRAINING_CACHE_PATH', 'models/training_cache.pkl')
     TEMPLATES_PATH = os.getenv('TEMPLATES_PATH', 'templates')
     STATIC_PATH = os.getenv('STATIC_PATH', 'static')
+    THUMBNAIL_CACHE_PATH = os.getenv('THUMBNAIL_CACHE_PATH', 'thumbnails_cache')
     
     # Model Configuration
     CONFIDENCE_THRESHOLD = float(os.getenv('CONFIDENCE_THRESHOLD', 0.6))
     FACE_TOLERANCE = float(os.getenv('FACE_TOLERANCE', 0.6))
     MAX_DETECTIONS_LIMIT = int(os.getenv('MAX_DETECTIONS_LIMIT', 50))
+    MULTI_FACE_ENABLED = os.getenv('MULTI_FACE_ENABLED', 'true').lower() == 'true'
+    DETECTION_MAX_SIDE = int(os.getenv('DETECTION_MAX_SIDE', 0))  # 0 = resolução original (ex.: 1280 para reduzir)
+    DETECTION_SCALE = float(os.getenv('DETECTION_SCALE', 1.0))
+    TRAINING_WORKERS = int(os.getenv('TRAINING_WORKERS', 1))  # 0 = todos os cores
+    MODEL_DELTA_MAX_GENERATIONS = int(os.getenv('MODEL_DELTA_MAX_GENERATIONS', 20))  # compactar o log a partir daqui
+    GALLERY_PROTOTYPES = int(os.getenv('GALLERY_PROTOTYPES', 0))  # protótipos por pessoa; 0 = todos os encodings
+    GALLERY_PROTOTYPE_METHOD = os.getenv('GALLERY_PROTOTYPE_METHOD', 'kmeans')  # kmeans ou medoids
+    
+    # Recognition Cache Configuration (imagens repetidas ou quase iguais)
+    RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 128))  # 0 = desligada
+    RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 10))  # segundos
+    RESULT_CACHE_MAX_DISTANCE = int(os.getenv('RESULT_CACHE_MAX_DISTANCE', 64))  # bits (de 1024); 0 = só ficheiros iguais
+    
+    # Thumbnail Configuration (página de validação)
+    THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', 320))
+    THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'jpeg')  # jpeg ou webp
+    THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 80))
+    THUMBNAIL_CACHE_MAX_MB = int(os.getenv('THUMBNAIL_CACHE_MAX_MB', 200))  # 0 = sem limite
+    THUMBNAIL_MAX_AGE = int(os.getenv('THUMBNAIL_MAX_AGE', 86400))  # Cache-Control em segundos
+    
+    # Ingestion Daemon Configuration
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 0))  # 0 = todos os cores
+    INGEST_MAX_PENDING = int(os.getenv('INGEST_MAX_PENDING', 0))  # 0 = 2x workers
+    INGEST_POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', 1.0))
+    
+    # Stream Configuration (vídeo / RTSP)
+    STREAM_WORKERS = int(os.getenv('STREAM_WORKERS', 2))  # 0 = todos os cores
+    STREAM_MAX_PENDING = int(os.getenv('STREAM_MAX_PENDING', 0))  # 0 = 2x workers
+    STREAM_SAMPLE_INTERVAL = float(os.getenv('STREAM_SAMPLE_INTERVAL', 0.5))  # segundos entre frames sem faces
+    STREAM_ACTIVE_INTERVAL = float(os.getenv('STREAM_ACTIVE_INTERVAL', 0.2))  # segundos entre frames com faces
+    STREAM_IOU_THRESHOLD = float(os.getenv('STREAM_IOU_THRESHOLD', 0.3))
+    STREAM_TRACK_TTL = float(os.getenv('STREAM_TRACK_TTL', 2.0))  # segundos até esquecer uma face
+    STREAM_RECONNECT_DELAY = float(os.getenv('STREAM_RECONNECT_DELAY', 5.0))
+    MOTION_ENABLED = os.getenv('MOTION_ENABLED', 'true').lower() == 'true'
+    MOTION_METHOD = os.getenv('MOTION_METHOD', 'diff')  # diff ou mog2
+    MOTION_THRESHOLD = float(os.getenv('MOTION_THRESHOLD', 25))  # diferença de intensidade (0-255)
+    MOTION_MIN_AREA = float(os.getenv('MOTION_MIN_AREA', 0.002))  # fração do frame
+    MOTION_FRAME_WIDTH = int(os.getenv('MOTION_FRAME_WIDTH', 160))  # largura da cópia analisada
+    
+    # Event Deduplication (rajadas de frames da mesma pessoa)
+    EVENT_COOLDOWN_SECONDS = float(os.getenv('EVENT_COOLDOWN_SECONDS', 60))  # repetições da mesma pessoa; 0 = desligado
+    
+    # ANN Index Configuration (galerias grandes)
+    ANN_ENABLED = os.getenv('ANN_ENABLED', 'false').lower() == 'true'
+    ANN_MIN_ENCODINGS = int(os.getenv('ANN_MIN_ENCODINGS', 10000))
+    ANN_N_LISTS = int(os.getenv('ANN_N_LISTS', 0))  # 0 = automático (sqrt(N))
+    ANN_N_PROBE = int(os.getenv('ANN_N_PROBE', 8))
+    ANN_PCA_DIMS = int(os.getenv('ANN_PCA_DIMS', 32))
+    ANN_RERANK = int(os.getenv('ANN_RERANK', 64))  # 0 = rerank exato de todos os candidatos
     
     # Home Assistant Configuration
-    HA_ENABLED = os.getenv('HA_ENABLED', 'false').lower() == 'true'
     HA_URL = os.getenv('HA_URL', 'http://localhost:8123')
     HA_TOKEN = os.getenv('HA_TOKEN', '')
+    HA_TOKEN_PLACEHOLDERS = ('', 'seu_token_aqui', 'your_ha_token_here')
+    # As saudações dependem só do token (como antes); HA_ENABLED por omissão acompanha-o
+    HA_ENABLED = os.getenv('HA_ENABLED', str(HA_TOKEN not in HA_TOKEN_PLACEHOLDERS)).lower() == 'true'
+    HA_MEDIA_PLAYER = os.getenv('HA_MEDIA_PLAYER', 'media_player.hub')
+    HA_TIMEOUT = float(os.getenv('HA_TIMEOUT', 5))
+    HA_QUEUE_SIZE = int(os.getenv('HA_QUEUE_SIZE', 100))
+    HA_MAX_RETRIES = int(os.getenv('HA_MAX_RETRIES', 3))
+    HA_RETRY_BACKOFF = float(os.getenv('HA_RETRY_BACKOFF', 1.0))
+    HA_COALESCE_SECONDS = float(os.getenv('HA_COALESCE_SECONDS', 30))
     
     @classmethod
     def validate(cls):
@@ -59,8 +121,11 @@ class Config:
         print(f"   Model Path: {cls.MODEL_PATH}")
         print(f"   Confidence Threshold: {cls.CONFIDENCE_THRESHOLD}")
         print(f"   Face Tolerance: {cls.FACE_TOLERANCE}")
-        print(f"   Home Assistant: {'Enabled' if cls.HA_ENABLED else 'Disabled'}")
-        if cls.HA_ENABLED:
+        print(f"   ANN Index: {'Enabled' if cls.ANN_ENABLED else 'Disabled'}")
+        print(f"   Gallery Prototypes: {cls.GALLERY_PROTOTYPES or 'All encodings'}")
+        ha_active = cls.HA_TOKEN not in cls.HA_TOKEN_PLACEHOLDERS
+        print(f"   Home Assistant: {'Enabled' if ha_active else 'Disabled'}")
+        if ha_active:
             print(f"   HA URL: {cls.HA_URL}")
             print(f"   HA Token: {'***' if cls.HA_TOKEN else 'Not set'}")
 
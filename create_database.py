@@ -3,13 +3,170 @@ import sqlite3
 import os
 from datetime import datetime
 
-def create_database():
-    """Criar base de dados SQLite"""
-    db_path = "face_recognition.db"
+# Migrações de esquema, aplicadas por ordem. PRAGMA user_version guarda a
+# última aplicada, por isso correr este script numa base de dados existente
+# aplica apenas as que faltam. Cada passo é um statement SQL ou uma função
+# que recebe o cursor (para passos condicionais, ver add_column).
+def add_column(table, column, definition):
+    """ADD COLUMN que não falha se a coluna já existir (bases criadas antes da migração)"""
+    def apply(cursor):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return apply
+
+MIGRATIONS = [
+    (1, "índices para a fila de validação, feedback e estatísticas", [
+        # Parcial: só as detecções por validar, já pela ordem da fila
+        """CREATE INDEX IF NOT EXISTS idx_detections_pending
+           ON detections(timestamp DESC) WHERE is_verified = FALSE""",
+        "CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON detections(timestamp)",
+        """CREATE INDEX IF NOT EXISTS idx_feedback_pending
+           ON feedback(detection_id) WHERE processed = FALSE""",
+        """CREATE INDEX IF NOT EXISTS idx_feedback_processed_created
+           ON feedback(created_at DESC) WHERE processed = TRUE""",
+    ]),
+    (2, "contadores de estatísticas mantidos por triggers", [
+        """CREATE TABLE IF NOT EXISTS detection_counters (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               total INTEGER NOT NULL,
+               verified INTEGER NOT NULL,
+               correct INTEGER NOT NULL
+           )""",
+        """CREATE TABLE IF NOT EXISTS feedback_counters (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               total INTEGER NOT NULL,
+               processed INTEGER NOT NULL
+           )""",
+        # Cada linha contribui com (1, verificada?, correta?); os triggers somam
+        # a contribuição da linha nova e subtraem a da antiga
+        """CREATE TRIGGER IF NOT EXISTS trg_detections_insert AFTER INSERT ON detections BEGIN
+               UPDATE detection_counters SET
+                   total = total + 1,
+                   verified = verified + (NEW.is_verified IS TRUE),
+                   correct = correct + (NEW.is_verified IS TRUE AND NEW.detected_person_id IS NEW.correct_person_id)
+               WHERE id = 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_detections_delete AFTER DELETE ON detections BEGIN
+               UPDATE detection_counters SET
+                   total = total - 1,
+                   verified = verified - (OLD.is_verified IS TRUE),
+                   correct = correct - (OLD.is_verified IS TRUE AND OLD.detected_person_id IS OLD.correct_person_id)
+               WHERE id = 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_detections_update
+           AFTER UPDATE OF is_verified, detected_person_id, correct_person_id ON detections BEGIN
+               UPDATE detection_counters SET
+                   verified = verified + (NEW.is_verified IS TRUE) - (OLD.is_verified IS TRUE),
+                   correct = correct
+                       + (NEW.is_verified IS TRUE AND NEW.detected_person_id IS NEW.correct_person_id)
+                       - (OLD.is_verified IS TRUE AND OLD.detected_person_id IS OLD.correct_person_id)
+               WHERE id = 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_feedback_insert AFTER INSERT ON feedback BEGIN
+               UPDATE feedback_counters SET
+                   total = total + 1,
+                   processed = processed + (NEW.processed IS TRUE)
+               WHERE id = 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_feedback_delete AFTER DELETE ON feedback BEGIN
+               UPDATE feedback_counters SET
+                   total = total - 1,
+                   processed = processed - (OLD.processed IS TRUE)
+               WHERE id = 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_feedback_update AFTER UPDATE OF processed ON feedback BEGIN
+               UPDATE feedback_counters SET
+                   processed = processed + (NEW.processed IS TRUE) - (OLD.processed IS TRUE)
+               WHERE id = 1;
+           END""",
+        # Preencher com o estado atual (na mesma transação que cria os triggers)
+        """INSERT OR REPLACE INTO detection_counters (id, total, verified, correct)
+           SELECT 1, COUNT(*),
+                  IFNULL(SUM(is_verified IS TRUE), 0),
+                  IFNULL(SUM(is_verified IS TRUE AND detected_person_id IS correct_person_id), 0)
+           FROM detections""",
+        """INSERT OR REPLACE INTO feedback_counters (id, total, processed)
+           SELECT 1, COUNT(*), IFNULL(SUM(processed IS TRUE), 0) FROM feedback""",
+    ]),
+    (3, "índice da fila de validação com chave (timestamp, id) para paginação por cursor", [
+        # Índice ascendente: o planeador usa-o para o intervalo (timestamp, id) < (?, ?)
+        # e percorre-o ao contrário para ORDER BY ... DESC
+        "DROP INDEX IF EXISTS idx_detections_pending",
+        """CREATE INDEX IF NOT EXISTS idx_detections_pending_keyset
+           ON detections(timestamp, id) WHERE is_verified = FALSE""",
+    ]),
+    (4, "encoding de cada face detetada (retreino sem reabrir as imagens)", [
+        # 128 float32 (face_matcher.pack_encoding); a caixa fica em face_location
+        "ALTER TABLE detections ADD COLUMN face_encoding BLOB",
+    ]),
+    (5, "área de deteção por fonte (mesmos valores da coluna detections.source)", [
+        # detection_area: 'top,right,bottom,left' em frações da imagem (detection_areas.py)
+        """CREATE TABLE IF NOT EXISTS source_settings (
+               source TEXT PRIMARY KEY,
+               detection_area TEXT,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )""",
+    ]),
+    (6, "repetições da mesma pessoa agrupadas numa só detecção", [
+        # Reconhecimentos repetidos dentro de EVENT_COOLDOWN_SECONDS (event_debounce.py)
+        "ALTER TABLE detections ADD COLUMN repeat_count INTEGER DEFAULT 1",
+        "ALTER TABLE detections ADD COLUMN last_seen TIMESTAMP",
+    ]),
+    (7, "índice das fontes com detecções pendentes (filtro da página de validação)", [
+        """CREATE INDEX IF NOT EXISTS idx_detections_pending_source
+           ON detections(source) WHERE is_verified = FALSE""",
+    ]),
+    (8, "caixa de cada face detetada", [
+        # 'top,right,bottom,left' em píxeis; bases anteriores já podem ter a coluna
+        add_column("detections", "face_location", "TEXT"),
+    ]),
+    (9, "ficheiros já ingeridos pelo modo --watch", [
+        # Caminho + tamanho + mtime (directory_watcher.ProcessedFileTracker)
+        """CREATE TABLE IF NOT EXISTS ingested_files (
+               path TEXT PRIMARY KEY,
+               size INTEGER,
+               mtime_ns INTEGER,
+               processed_at TIMESTAMP
+           )""",
+    ]),
+]
+
+def migrate_database(conn):
+    """Aplicar as migrações em falta, cada uma numa transação própria"""
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    
+    for target, description, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        
+        conn.commit()
+        # IMMEDIATE: nenhum outro processo escreve entre criar triggers e preencher contadores
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in statements:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"✅ Migração {target} aplicada: {description}")
     
+    return max(version, MIGRATIONS[-1][0])
+
+def create_database(db_path="face_recognition.db"):
+    """Criar base de dados SQLite"""
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
+    # WAL fica gravado no ficheiro: leitores (app web) não bloqueiam o escritor (daemon)
+    cursor.execute("PRAGMA journal_mode=WAL")
+    
     # Tabela de pessoas conhecidas
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS people (
@@ -64,6 +221,10 @@ def create_database():
             print(f"⚠️ Aviso ao adicionar coluna 'source': {e}")
     
     conn.commit()
+    
+    # Restantes colunas, tabelas, índices e contadores (também atualiza bases de dados antigas)
+    migrate_database(conn)
+    
     conn.close()
     print("✅ Base de dados criada com sucesso!")
 
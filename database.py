@@ -0,0 +1,211 @@
+# database.py - Camada de acesso à base de dados SQLite partilhada
+import os
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from config import config
+
+# Pragmas aplicados a cada ligação nova. WAL permite leituras concorrentes com
+# uma escrita; synchronous=NORMAL é seguro em WAL e evita um fsync por commit.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+)
+
+
+def is_busy_error(error):
+    """SQLITE_BUSY / SQLITE_LOCKED chegam como OperationalError com esta mensagem"""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class Database:
+    """Pool de ligações SQLite com WAL, cache de statements e repetição em SQLITE_BUSY
+
+    Cada operação pede uma ligação ao pool e devolve-a no fim, pelo que várias
+    threads (pedidos Flask, daemon de ingestão) reutilizam as mesmas ligações
+    sem abrir ficheiros a cada chamada. Um processo criado por fork() (pools
+    de processos) começa com o pool vazio e abre as suas próprias ligações.
+    """
+
+    def __init__(self, db_path, pool_size=None, busy_timeout_ms=None, max_retries=None):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms or config.DB_BUSY_TIMEOUT_MS
+        self.max_retries = config.DB_MAX_RETRIES if max_retries is None else max_retries
+        self.pool = queue.LifoQueue(maxsize=pool_size or config.DB_POOL_SIZE)
+        _instances.add(self)
+
+    def _reset_after_fork(self):
+        """No processo filho: esquecer as ligações herdadas do pai
+
+        O SQLite não permite usar no filho uma ligação aberta antes do fork;
+        também não são fechadas (o close mexeria nos ficheiros do pai), ficam
+        apenas guardadas para nunca serem recolhidas.
+        """
+        while True:
+            try:
+                _inherited_connections.append(self.pool.get_nowait())
+            except queue.Empty:
+                break
+        self.pool = queue.LifoQueue(maxsize=self.pool.maxsize)
+
+    def _connect(self):
+        # isolation_level=None: sem transações implícitas; escritas usam BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000,
+                               isolation_level=None, check_same_thread=False,
+                               cached_statements=256)
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Obter uma ligação do pool (criada se o pool estiver vazio)"""
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self.pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def _retry(self, operation):
+        """Repetir a operação com backoff se a base de dados estiver ocupada"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return operation()
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == self.max_retries:
+                    raise
+                time.sleep(0.05 * (2 ** attempt))
+
+    def fetchall(self, sql, params=()):
+        """Executar consulta e devolver todas as linhas"""
+        def operation():
+            with self.connection() as conn:
+                return conn.execute(sql, params).fetchall()
+        return self._retry(operation)
+
+    def fetchone(self, sql, params=()):
+        """Executar consulta e devolver a primeira linha (ou None)"""
+        def operation():
+            with self.connection() as conn:
+                return conn.execute(sql, params).fetchone()
+        return self._retry(operation)
+
+    def transaction(self, func, *args, **kwargs):
+        """Executar func(cursor, ...) numa transação de escrita e devolver o seu resultado
+
+        A transação inteira é repetida se a base de dados estiver ocupada, por
+        isso func não deve ter efeitos fora da base de dados.
+        """
+        def operation():
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    result = func(cursor, *args, **kwargs)
+                    conn.commit()
+                    return result
+                except BaseException:
+                    conn.rollback()
+                    raise
+        return self._retry(operation)
+
+    def execute(self, sql, params=()):
+        """Executar uma escrita na sua própria transação; devolve lastrowid"""
+        return self.transaction(lambda cursor: cursor.execute(sql, params).lastrowid)
+
+    def executemany(self, sql, seq_of_params):
+        """Executar a mesma escrita para vários parâmetros numa só transação; devolve rowcount"""
+        return self.transaction(lambda cursor: cursor.executemany(sql, seq_of_params).rowcount)
+
+    def close(self):
+        """Fechar todas as ligações inativas do pool"""
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+_instances = weakref.WeakSet()
+_inherited_connections = []
+
+
+def _after_fork_in_child():
+    global _databases_lock
+    _databases_lock = threading.Lock()
+    for database in list(_instances):
+        database._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def get_database(db_path=None):
+    """Instância partilhada (uma por ficheiro) da camada de acesso"""
+    db_path = db_path or config.DB_PATH
+    with _databases_lock:
+        if db_path not in _databases:
+            _databases[db_path] = Database(db_path)
+        return _databases[db_path]
+
+
+def detection_counts(conn):
+    """(total, verificadas, corretas) das detecções
+
+    Lê os contadores mantidos por triggers (ver create_database.py); numa base
+    de dados ainda não migrada faz uma única consulta agregada.
+    """
+    try:
+        row = conn.execute("SELECT total, verified, correct FROM detection_counters WHERE id = 1").fetchone()
+        if row:
+            return row
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e).lower():
+            raise
+
+    return conn.execute("""
+        SELECT COUNT(*),
+               IFNULL(SUM(is_verified = TRUE), 0),
+               IFNULL(SUM(is_verified = TRUE AND
+                          (detected_person_id = correct_person_id OR
+                           (detected_person_id IS NULL AND correct_person_id IS NULL))), 0)
+        FROM detections
+    """).fetchone()
+
+
+def feedback_counts(conn):
+    """(total, processado, pendente) do feedback, tal como detection_counts"""
+    try:
+        row = conn.execute("SELECT total, processed FROM feedback_counters WHERE id = 1").fetchone()
+        if row:
+            return row[0], row[1], row[0] - row[1]
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e).lower():
+            raise
+
+    return conn.execute("""
+        SELECT COUNT(*),
+               IFNULL(SUM(processed = TRUE), 0),
+               IFNULL(SUM(processed = FALSE), 0)
+        FROM feedback
+    """).fetchone()
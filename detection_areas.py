@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# detection_areas.py - Área de deteção (ROI) por fonte, guardada na tabela source_settings
+import sys
+import time
+from datetime import datetime
+from database import get_database
+
+# Segundos até voltar a ler as áreas da base de dados (alterações feitas noutro processo)
+REFRESH_INTERVAL = 30
+
+
+def parse_area(value):
+    """'top,right,bottom,left' em frações da imagem (0-1) -> tuplo de floats, ou None"""
+    if not value:
+        return None
+    try:
+        top, right, bottom, left = (float(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError(f"Área inválida '{value}': use top,right,bottom,left entre 0 e 1")
+    if not (0 <= top < bottom <= 1 and 0 <= left < right <= 1):
+        raise ValueError(f"Área inválida '{value}': use top,right,bottom,left entre 0 e 1")
+    return top, right, bottom, left
+
+
+def area_in_pixels(area, image_shape):
+    """Área em frações -> caixa (top, right, bottom, left) em pixels da imagem"""
+    height, width = image_shape[:2]
+    top, right, bottom, left = area
+    return (int(top * height), int(round(right * width)), int(round(bottom * height)), int(left * width))
+
+
+def set_detection_area(source, area, db_path=None):
+    """Guardar (ou remover, com area=None) a área de deteção de uma fonte"""
+    db = get_database(db_path)
+    if area is None:
+        db.execute("DELETE FROM source_settings WHERE source = ?", (source,))
+        return
+    db.execute("""
+        INSERT INTO source_settings (source, detection_area, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(source) DO UPDATE SET detection_area = excluded.detection_area,
+                                          updated_at = excluded.updated_at
+    """, (source, ','.join(f"{v:g}" for v in area), datetime.now().isoformat()))
+
+
+class DetectionAreas:
+    """Áreas de deteção por fonte, em memória e relidas a cada REFRESH_INTERVAL segundos"""
+
+    def __init__(self, db_path=None):
+        self.db = get_database(db_path)
+        self._areas = {}
+        self._loaded_at = None
+
+    def _refresh(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < REFRESH_INTERVAL:
+            return
+        areas = {}
+        try:
+            for source, value in self.db.fetchall("SELECT source, detection_area FROM source_settings"):
+                try:
+                    areas[source] = parse_area(value)
+                except ValueError as e:
+                    print(f"⚠️ {source}: {e}")
+        except Exception as e:
+            # Base de dados sem a migração 5: sem áreas configuradas
+            print(f"⚠️ Áreas de deteção indisponíveis: {e}")
+        self._areas = areas
+        self._loaded_at = time.monotonic()
+
+    def get(self, source):
+        """Área (frações) configurada para a fonte, ou None (imagem inteira)"""
+        if not source:
+            return None
+        self._refresh()
+        return self._areas.get(source)
+
+    def all(self):
+        self._refresh()
+        return dict(self._areas)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ['set'] and len(args) == 3:
+        set_detection_area(args[1], parse_area(args[2]))
+        print(f"✅ Área de deteção de {args[1]}: {args[2]}")
+    elif args[:1] == ['clear'] and len(args) == 2:
+        set_detection_area(args[1], None)
+        print(f"✅ Área de deteção de {args[1]} removida (imagem inteira)")
+    elif args[:1] in ([], ['list']):
+        areas = DetectionAreas().all()
+        if not areas:
+            print("ℹ️ Nenhuma área de deteção configurada")
+        for source, area in sorted(areas.items()):
+            print(f"  • {source}: {','.join(f'{v:g}' for v in area)}")
+    else:
+        print("Uso:")
+        print("  python detection_areas.py [list]")
+        print("  python detection_areas.py set <fonte> <top,right,bottom,left>   # frações 0-1")
+        print("  python detection_areas.py clear <fonte>")
+        print("\nFontes: file, mobile_capture, stream:<nome> (ver coluna source das detecções)")
@@ -0,0 +1,163 @@
+# directory_watcher.py - Vigiar uma pasta de entrada (inotify com fallback para polling)
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from datetime import datetime
+from create_database import migrate_database
+from database import get_database
+
+# Constantes inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def scan_directory(directory, extensions):
+    """Imagens existentes na pasta, das mais antigas para as mais recentes"""
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.lower().endswith(extensions):
+                entries.append((entry.stat().st_mtime_ns, entry.path))
+    return [path for _, path in sorted(entries)]
+
+
+class InotifyWatcher:
+    """Notificações do kernel para ficheiros fechados após escrita ou movidos para a pasta"""
+
+    def __init__(self, directory, extensions):
+        self.directory = directory
+        self.extensions = extensions
+
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError("libc não encontrada")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falhou")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch falhou para {directory}")
+
+    def poll(self, timeout):
+        """Novos ficheiros prontos (espera no máximo timeout segundos)"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+            offset += INOTIFY_EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Fila do kernel transbordou: voltar a listar a pasta
+                return scan_directory(self.directory, self.extensions)
+            name = os.fsdecode(name)
+            if name.lower().endswith(self.extensions):
+                paths.append(os.path.join(self.directory, name))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Listagem periódica; um ficheiro só é reportado quando tamanho e mtime estabilizam"""
+
+    def __init__(self, directory, extensions, interval=1.0):
+        self.directory = directory
+        self.extensions = extensions
+        self.interval = interval
+        self.last_scan = 0.0
+        self.previous = {}  # caminho -> (tamanho, mtime) na listagem anterior
+        self.reported = {}  # caminho -> (tamanho, mtime) já reportado
+
+    def poll(self, timeout):
+        """Novos ficheiros estáveis (espera no máximo timeout segundos)"""
+        wait = self.last_scan + self.interval - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if wait > timeout:
+                return []
+        self.last_scan = time.monotonic()
+
+        current = {}
+        for path in scan_directory(self.directory, self.extensions):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            current[path] = (stat.st_size, stat.st_mtime_ns)
+
+        stable = [path for path, signature in current.items()
+                  if self.previous.get(path) == signature and self.reported.get(path) != signature]
+        for path in stable:
+            self.reported[path] = current[path]
+
+        self.previous = current
+        self.reported = {path: sig for path, sig in self.reported.items() if path in current}
+        return stable
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory, extensions, poll_interval=1.0):
+    """inotify quando disponível (Linux), caso contrário polling"""
+    try:
+        watcher = InotifyWatcher(directory, extensions)
+        print(f"👁️ A vigiar {directory} (inotify)")
+        return watcher
+    except (OSError, AttributeError) as e:
+        print(f"ℹ️ inotify indisponível ({e}) - a usar polling a cada {poll_interval}s")
+        return PollingWatcher(directory, extensions, poll_interval)
+
+
+class ProcessedFileTracker:
+    """Registo de ficheiros já ingeridos (caminho + tamanho + mtime) para não reprocessar após reinício"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.db = get_database(db_path)
+        # A tabela ingested_files é uma migração: aplicar as que faltarem
+        with self.db.connection() as conn:
+            migrate_database(conn)
+
+    def is_processed(self, path):
+        """Verificar se o ficheiro (nesta versão) já foi processado"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return True
+
+        result = self.db.fetchone("SELECT 1 FROM ingested_files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                                  (os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+        return result is not None
+
+    def mark_processed(self, path):
+        """Registar ficheiro como processado"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+
+        self.db.execute("""
+            INSERT OR REPLACE INTO ingested_files (path, size, mtime_ns, processed_at)
+            VALUES (?, ?, ?, ?)
+        """, (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, datetime.now().isoformat()))
@@ -0,0 +1,96 @@
+# event_debounce.py - Reconhecimentos repetidos da mesma pessoa contam como um só evento
+import threading
+import time
+import numpy as np
+from config import config
+
+
+class EventDebouncer:
+    """Janela de espera por pessoa (e por fonte) entre eventos
+
+    Uma face conhecida com o mesmo nome, ou uma desconhecida com encoding a
+    menos de tolerance de outra desconhecida recente, vista menos de window
+    segundos depois da última vez é uma repetição: em vez de uma nova detecção
+    (e saudação) incrementa-se o repeat_count da detecção do evento. A janela
+    desliza - uma pessoa que fica à frente da câmara é um só evento.
+
+    now é por omissão time.monotonic(); fontes que não são ao vivo (ficheiros
+    de vídeo) passam o tempo do próprio frame. Cada fonte só é comparada com
+    o seu próprio relógio, e um tempo que volta atrás (o mesmo vídeo de novo)
+    termina os eventos dessa fonte.
+    """
+
+    def __init__(self, window=None, tolerance=None):
+        self.window = config.EVENT_COOLDOWN_SECONDS if window is None else window
+        self.tolerance = config.FACE_TOLERANCE if tolerance is None else tolerance
+        self._known = {}    # (fonte, nome) -> [id da detecção, visto em]
+        self._unknown = {}  # fonte -> [[encoding, id da detecção, visto em], ...]
+        self._lock = threading.Lock()
+        self.stats = {'events': 0, 'repeats': 0}
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def _active(self, event, now):
+        return 0 <= now - event[-1] < self.window
+
+    def _expire(self, source, now):
+        for key in [key for key in self._known if key[0] == source]:
+            if not self._active(self._known[key], now):
+                del self._known[key]
+        events = [event for event in self._unknown.get(source, []) if self._active(event, now)]
+        if events:
+            self._unknown[source] = events
+        else:
+            self._unknown.pop(source, None)
+
+    def _find(self, face, source):
+        """Evento recente da mesma pessoa, ou None"""
+        if face['name'] != "Desconhecido":
+            return self._known.get((source, face['name']))
+        if face.get('encoding') is None or source not in self._unknown:
+            return None
+        events = self._unknown[source]
+        distances = np.linalg.norm(np.array([event[0] for event in events]) - face['encoding'], axis=1)
+        best = int(np.argmin(distances))
+        return events[best] if distances[best] < self.tolerance else None
+
+    def split(self, faces, source, now=None):
+        """Separar as faces novas das repetidas
+
+        Devolve (faces novas, {id da detecção: repetições}); as repetições
+        ficam já registadas (a janela recomeça).
+        """
+        if not self.enabled:
+            return list(faces), {}
+        now = time.monotonic() if now is None else now
+
+        new_faces, repeats = [], {}
+        with self._lock:
+            self._expire(source, now)
+            for face in faces:
+                event = self._find(face, source)
+                if event is None:
+                    new_faces.append(face)
+                    continue
+                event[-1] = now
+                detection_id = event[-2]
+                repeats[detection_id] = repeats.get(detection_id, 0) + 1
+                self.stats['repeats'] += 1
+        return new_faces, repeats
+
+    def record(self, faces, detection_ids, source, now=None):
+        """Registar as detecções novas como início de um evento"""
+        if not self.enabled:
+            return
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            for face, detection_id in zip(faces, detection_ids):
+                self.stats['events'] += 1
+                if face['name'] != "Desconhecido":
+                    self._known[(source, face['name'])] = [detection_id, now]
+                elif face.get('encoding') is not None:
+                    self._unknown.setdefault(source, []).append(
+                        [np.asarray(face['encoding'], dtype=np.float64), detection_id, now])
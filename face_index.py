@@ -0,0 +1,187 @@
+# face_index.py
+import hashlib
+import os
+import numpy as np
+from config import config
+
+
+def index_path_for(model_path):
+    """Caminho do índice ANN guardado ao lado do modelo"""
+    return os.path.splitext(model_path)[0] + '.ivf.npz'
+
+
+def matrix_fingerprint(sq_norms):
+    """Impressão digital barata da matriz de encodings (valida que o índice corresponde ao modelo)"""
+    return hashlib.sha1(np.ascontiguousarray(sq_norms, dtype=np.float32).tobytes()).hexdigest()
+
+
+def _sq_distances(a, b, b_sq=None):
+    """Distâncias euclidianas ao quadrado (len(a) x len(b))"""
+    if b_sq is None:
+        b_sq = np.einsum('ij,ij->i', b, b)
+    d = a @ b.T
+    d *= -2
+    d += np.einsum('ij,ij->i', a, a)[:, None]
+    d += b_sq[None, :]
+    return np.maximum(d, 0, out=d)
+
+
+def kmeans(data, n_clusters, n_iter=10, seed=0):
+    """K-means (Lloyd) simples em NumPy; devolve os centróides"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = np.argmin(_sq_distances(data, centroids), axis=1)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+
+        # Clusters vazios são reiniciados com um ponto aleatório
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+
+    return centroids
+
+
+class IVFIndex:
+    """Índice IVF: quantizador grosseiro k-means + listas invertidas
+
+    Os candidatos das listas sondadas são ordenados numa projeção PCA de baixa
+    dimensão e os melhores ``rerank`` são re-pontuados exatamente na matriz
+    completa do FaceMatcher.
+    """
+
+    def __init__(self, centroids, list_offsets, list_ids, projection, projected, fingerprint):
+        self.centroids = centroids
+        self.centroid_sq = np.einsum('ij,ij->i', centroids, centroids)
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.projection = projection
+        self.projected = projected
+        self.projected_sq = np.einsum('ij,ij->i', projected, projected)
+        self.fingerprint = fingerprint
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, encodings, sq_norms, n_lists=None, pca_dims=None, n_iter=10, seed=0):
+        """Construir o índice a partir da matriz de encodings do FaceMatcher"""
+        encodings = np.asarray(encodings, dtype=np.float32)
+        n_lists = n_lists or config.ANN_N_LISTS or max(1, int(np.sqrt(len(encodings))))
+        n_lists = min(n_lists, len(encodings))
+        pca_dims = pca_dims or config.ANN_PCA_DIMS
+
+        # Treinar k-means numa amostra (~256 pontos por lista chega)
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(encodings), 256 * n_lists)
+        sample = encodings[rng.choice(len(encodings), sample_size, replace=False)]
+        centroids = kmeans(sample, n_lists, n_iter=n_iter, seed=seed)
+
+        # Atribuir todos os encodings às listas (por blocos para limitar memória)
+        assignment = np.empty(len(encodings), dtype=np.int64)
+        for start in range(0, len(encodings), 65536):
+            block = encodings[start:start + 65536]
+            assignment[start:start + len(block)] = np.argmin(_sq_distances(block, centroids), axis=1)
+
+        list_ids = np.argsort(assignment, kind='stable').astype(np.int64)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=list_offsets[1:])
+
+        # Projeção PCA (as distâncias não dependem da média, basta a base ortonormal)
+        centered = sample - sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(centered, full_matrices=False)
+        projection = np.ascontiguousarray(vt[:pca_dims].T, dtype=np.float32)
+        projected = np.ascontiguousarray(encodings[list_ids] @ projection, dtype=np.float32)
+
+        return cls(centroids.astype(np.float32), list_offsets, list_ids, projection, projected,
+                   matrix_fingerprint(sq_norms))
+
+    def save(self, path):
+        """Guardar o índice (escrita atómica)"""
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path,
+                 centroids=self.centroids,
+                 list_offsets=self.list_offsets,
+                 list_ids=self.list_ids,
+                 projection=self.projection,
+                 projected=self.projected,
+                 fingerprint=np.array(self.fingerprint))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Carregar índice guardado com save()"""
+        with np.load(path) as data:
+            return cls(data['centroids'], data['list_offsets'], data['list_ids'],
+                       data['projection'], data['projected'], str(data['fingerprint']))
+
+    def search(self, matcher, queries, k=1, n_probe=None, rerank=None):
+        """Top-k aproximado; devolve (índices, distâncias) exatas como FaceMatcher.top_k"""
+        n_probe = min(n_probe or config.ANN_N_PROBE, self.n_lists)
+        rerank = config.ANN_RERANK if rerank is None else rerank
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, matcher.encodings.shape[1])
+
+        probes = np.argsort(_sq_distances(queries, self.centroids, self.centroid_sq), axis=1)[:, :n_probe]
+        projected_queries = queries @ self.projection
+
+        top_idx = np.zeros((len(queries), k), dtype=np.int64)
+        top_dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+
+        for i, query in enumerate(queries):
+            positions = np.concatenate([np.arange(self.list_offsets[p], self.list_offsets[p + 1]) for p in probes[i]])
+            if len(positions) == 0:
+                continue
+
+            # Pré-seleção na projeção PCA; rerank=0 pontua exatamente todos os candidatos
+            if rerank and len(positions) > rerank:
+                approx = _sq_distances(projected_queries[i:i + 1], self.projected[positions], self.projected_sq[positions])[0]
+                positions = positions[np.argpartition(approx, rerank - 1)[:rerank]]
+
+            candidates = self.list_ids[positions]
+            exact = _sq_distances(query[None, :], matcher.encodings[candidates], matcher.sq_norms[candidates])[0]
+            n = min(k, len(candidates))
+            best = np.argsort(exact, kind='stable')[:n]
+            top_idx[i, :n] = candidates[best]
+            top_dist[i, :n] = np.sqrt(exact[best])
+
+        return top_idx, top_dist
+
+
+def build_index_for_model(matcher, model_path):
+    """Construir e guardar o índice ANN ao lado do modelo, se ativo e a galeria for grande"""
+    path = index_path_for(model_path)
+
+    if not config.ANN_ENABLED or len(matcher) < config.ANN_MIN_ENCODINGS:
+        # Remover índice antigo para não ficar desatualizado
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+
+    index = IVFIndex.build(matcher.encodings, matcher.sq_norms)
+    index.save(path)
+    print(f"🗂️ Índice ANN guardado em {path} ({index.n_lists} listas)")
+    return index
+
+
+def load_index_for_model(matcher, model_path):
+    """Carregar o índice ANN do modelo se existir e corresponder à matriz atual"""
+    path = index_path_for(model_path)
+    if not config.ANN_ENABLED or not os.path.exists(path):
+        return None
+
+    try:
+        index = IVFIndex.load(path)
+    except Exception as e:
+        print(f"⚠️ Erro ao carregar índice ANN: {e}")
+        return None
+
+    if index.fingerprint != matrix_fingerprint(matcher.sq_norms):
+        print("⚠️ Índice ANN não corresponde ao modelo - a usar pesquisa exata")
+        return None
+
+    return index
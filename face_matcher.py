@@ -0,0 +1,149 @@
+# face_matcher.py
+import numpy as np
+
+ENCODING_SIZE = 128
+ENCODING_DTYPE = np.dtype('<f4')
+
+
+def pack_encoding(encoding):
+    """Encoding -> BLOB compacto (128 float32 little-endian, 512 bytes)"""
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).reshape(ENCODING_SIZE).tobytes()
+
+
+def unpack_encoding(blob):
+    """BLOB de pack_encoding -> array float64; None se vazio ou inválido"""
+    if not blob or len(blob) != ENCODING_SIZE * ENCODING_DTYPE.itemsize:
+        return None
+    return np.frombuffer(blob, dtype=ENCODING_DTYPE).astype(np.float64)
+
+
+class FaceMatcher:
+    """Motor de comparação vetorizado sobre uma matriz (N x 128) de encodings"""
+
+    def __init__(self, encodings, names):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if len(encodings) != len(names):
+            raise ValueError(f"encodings ({len(encodings)}) e names ({len(names)}) com tamanhos diferentes")
+
+        # Tabela de nomes com ids inteiros; linhas ordenadas por pessoa para
+        # permitir reduções por pessoa com np.minimum.reduceat
+        self.label_names, labels = np.unique(np.asarray(names, dtype=object), return_inverse=True)
+        self.label_names = [str(name) for name in self.label_names]
+        order = np.argsort(labels, kind='stable')
+
+        self.encodings = np.ascontiguousarray(encodings[order])
+        self.labels = labels[order].astype(np.int32)
+        self.sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+        self.label_starts = np.flatnonzero(np.r_[True, np.diff(self.labels) != 0]) if len(self.labels) else np.empty(0, dtype=np.intp)
+        self.index = None
+
+    @classmethod
+    def from_arrays(cls, encodings, labels, label_names, sq_norms, label_starts):
+        """Criar a partir de arrays já agrupados por pessoa (ex.: mapeados do modelo binário)"""
+        matcher = cls.__new__(cls)
+        matcher.encodings = encodings
+        matcher.labels = labels
+        matcher.label_names = list(label_names)
+        matcher.sq_norms = sq_norms
+        matcher.label_starts = label_starts
+        matcher.index = None
+        return matcher
+
+    def __len__(self):
+        return len(self.encodings)
+
+    def with_people(self, updates):
+        """Novo FaceMatcher com as linhas das pessoas em updates substituídas
+
+        updates: {nome: encodings (k x 128)}; k = 0 remove a pessoa. As outras
+        pessoas são copiadas tal como estão, sem recalcular normas nem reordenar.
+        """
+        ends = np.r_[self.label_starts[1:], len(self)].astype(np.intp)
+        blocks = []
+        for label, name in enumerate(self.label_names):
+            if name not in updates:
+                start, end = self.label_starts[label], ends[label]
+                blocks.append((name, self.encodings[start:end], self.sq_norms[start:end]))
+        for name, encodings in updates.items():
+            encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            if len(encodings):
+                blocks.append((name, encodings, np.einsum('ij,ij->i', encodings, encodings)))
+
+        if not blocks:
+            return FaceMatcher([], [])
+
+        counts = [len(block[1]) for block in blocks]
+        return FaceMatcher.from_arrays(
+            np.concatenate([block[1] for block in blocks]),
+            np.repeat(np.arange(len(blocks), dtype=np.int32), counts),
+            [block[0] for block in blocks],
+            np.concatenate([block[2] for block in blocks]),
+            np.r_[0, np.cumsum(counts)[:-1]].astype(np.int64),
+        )
+
+    @property
+    def names(self):
+        """Nome associado a cada linha da matriz"""
+        return [self.label_names[label] for label in self.labels]
+
+    def distance_matrix(self, queries):
+        """Distâncias euclidianas (M x N) entre as queries e todos os encodings, numa só multiplicação"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        query_sq = np.einsum('ij,ij->i', queries, queries)
+
+        # ||q - e||^2 = ||q||^2 + ||e||^2 - 2 q.e
+        sq_dist = queries @ self.encodings.T
+        sq_dist *= -2
+        sq_dist += query_sq[:, None]
+        sq_dist += self.sq_norms[None, :]
+        np.maximum(sq_dist, 0, out=sq_dist)
+        return np.sqrt(sq_dist, out=sq_dist)
+
+    def top_k(self, distances, k=1):
+        """Índices e distâncias dos k encodings mais próximos de cada query (ordenados)"""
+        k = min(k, distances.shape[1])
+        if k < distances.shape[1]:
+            idx = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            idx = np.broadcast_to(np.arange(distances.shape[1]), distances.shape).copy()
+        dist = np.take_along_axis(distances, idx, axis=1)
+        order = np.argsort(dist, axis=1, kind='stable')
+        return np.take_along_axis(idx, order, axis=1), np.take_along_axis(dist, order, axis=1)
+
+    def person_min_distances(self, distances):
+        """Distância mínima de cada query a cada pessoa (M x P, colunas em label_names)"""
+        return np.minimum.reduceat(distances, self.label_starts, axis=1)
+
+    def match(self, queries, k=1, per_person=False):
+        """Comparar um lote de encodings com o modelo
+
+        Devolve uma lista (uma entrada por query) com o melhor nome, distância,
+        os top-k vizinhos e, se pedido, a distância mínima por pessoa.
+        """
+        if len(self) == 0:
+            return []
+
+        top_idx = None
+        if self.index is not None and not per_person:
+            # Pesquisa aproximada (IVF) com rerank exato
+            top_idx, top_dist = self.index.search(self, queries, k)
+            if np.isinf(top_dist[:, 0]).any():
+                top_idx = None
+
+        if top_idx is None:
+            distances = self.distance_matrix(queries)
+            top_idx, top_dist = self.top_k(distances, k)
+        person_dist = self.person_min_distances(distances) if per_person else None
+
+        results = []
+        for i in range(len(top_idx)):
+            result = {
+                'name': self.label_names[self.labels[top_idx[i, 0]]],
+                'distance': float(top_dist[i, 0]),
+                'top_k': [(self.label_names[self.labels[j]], float(d))
+                          for j, d in zip(top_idx[i], top_dist[i]) if np.isfinite(d)]
+            }
+            if per_person:
+                result['person_distances'] = dict(zip(self.label_names, person_dist[i].tolist()))
+            results.append(result)
+        return results
@@ -4,103 +4,366 @@ warnings.filterwarnings("ignore", message="pkg_resources is deprecated")
 
 import face_recognition
 import cv2
-import pickle
-import sqlite3
 import numpy as np
 from datetime import datetime
+import io
 import os
+import threading
 from config import config
+from database import get_database
+from face_matcher import FaceMatcher, pack_encoding
+from face_index import load_index_for_model
+from model_store import open_model, read_model_deltas, apply_model_deltas, delta_path_for
+from detection_areas import DetectionAreas, area_in_pixels
+from recognition_cache import RecognitionCache, content_hash, perceptual_hash
+
+def downscale_for_detection(image, max_side=None, scale=None):
+    """Reduzir a imagem antes da deteção HOG (o custo cresce com o nº de pixels)
+    
+    Devolve (imagem reduzida, fator aplicado); fator 1.0 significa sem redução.
+    """
+    max_side = config.DETECTION_MAX_SIDE if max_side is None else max_side
+    scale = config.DETECTION_SCALE if scale is None else scale
+    
+    factor = min(scale, 1.0) if scale and scale > 0 else 1.0
+    longest = max(image.shape[:2])
+    if max_side and longest * factor > max_side:
+        factor = max_side / longest
+    
+    if factor >= 1.0:
+        return image, 1.0
+    small = cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    return small, factor
+
+def scale_face_location(location, factor, image_shape):
+    """Mapear uma caixa (top, right, bottom, left) da imagem reduzida para a original"""
+    if factor == 1.0:
+        return location
+    height, width = image_shape[:2]
+    top, right, bottom, left = location
+    return (
+        max(0, int(round(top / factor))),
+        min(width, int(round(right / factor))),
+        min(height, int(round(bottom / factor))),
+        max(0, int(round(left / factor)))
+    )
 
 class FaceRecognizer:
     def __init__(self, db_path=None, model_path=None):
         self.db_path = db_path or config.DB_PATH
+        self.db = get_database(self.db_path)
         self.model_path = model_path or config.MODEL_PATH
-        self.known_encodings = []
-        self.known_names = []
         self.confidence_threshold = config.CONFIDENCE_THRESHOLD
+        # Área de deteção configurada por fonte (detection_areas.py)
+        self.detection_areas = DetectionAreas(self.db_path)
+        # Resultados recentes para imagens repetidas (recognition_cache.py)
+        self.result_cache = RecognitionCache()
+        
+        # Snapshot imutável do modelo - trocado de uma só vez no reload
+        self._matcher = FaceMatcher([], [])
+        self._model_signature = None
+        # Geração aplicada e posição já lida do log de gerações (<modelo>.delta)
+        self.generation = 0
+        self._delta_offset = 0
+        self._reload_lock = threading.RLock()
         
         # Carregar modelo se existir
         self.load_model()
     
+    @property
+    def known_encodings(self):
+        return self._matcher.encodings
+    
+    @property
+    def known_names(self):
+        return self._matcher.names
+    
+    def is_model_loaded(self):
+        """Indica se existe um modelo com encodings carregado"""
+        return len(self._matcher) > 0
+    
+    def _get_model_signature(self):
+        """Assinatura do ficheiro do modelo (mtime, tamanho, inode)"""
+        try:
+            stat = os.stat(self.model_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    
     def load_model(self):
         """Carregar modelo treinado"""
-        if os.path.exists(self.model_path):
-            try:
-                with open(self.model_path, 'rb') as f:
-                    model_data = pickle.load(f)
-                    self.known_encodings = model_data['encodings']
-                    self.known_names = model_data['names']
-                print(f"✅ Modelo carregado: {len(self.known_encodings)} encodings")
-                return True
-            except Exception as e:
-                print(f"❌ Erro ao carregar modelo: {e}")
+        with self._reload_lock:
+            signature = self._get_model_signature()
+            if signature is not None:
+                try:
+                    # Formato binário é mapeado em memória (tempo constante);
+                    # modelos pickle antigos continuam a ser suportados
+                    matcher, metadata = open_model(self.model_path)
+                    matcher.index = load_index_for_model(matcher, self.model_path)
+                    generation = metadata.get('generation', 0)
+                    
+                    # Atualizações incrementais posteriores ao modelo base
+                    # (o índice ANN só cobre o modelo base e deixa de ser usado)
+                    try:
+                        records, offset = read_model_deltas(self.model_path)
+                        matcher, generation = apply_model_deltas(matcher, records, generation)
+                    except Exception as e:
+                        print(f"⚠️ Erro ao ler log de gerações, a usar só o modelo base: {e}")
+                        offset = 0
+                    
+                    # Troca atómica: pedidos em curso continuam com o snapshot anterior
+                    self._matcher = matcher
+                    self._model_signature = signature
+                    self.generation = generation
+                    self._delta_offset = offset
+                    print(f"✅ Modelo carregado: {len(self.known_encodings)} encodings (geração {generation})")
+                    return True
+                except Exception as e:
+                    print(f"❌ Erro ao carregar modelo: {e}")
+                    return False
         
         print("⚠️ Modelo não encontrado. Execute o treino primeiro.")
         return False
     
-    def recognize_face_in_image(self, image_path):
-        """Reconhecer face numa imagem"""
-        if not self.known_encodings:
-            return None, 0.0, "Modelo não carregado"
-        
+    def _get_delta_size(self):
         try:
-            # Carregar imagem
-            image = face_recognition.load_image_file(image_path)
+            return os.stat(delta_path_for(self.model_path)).st_size
+        except OSError:
+            return 0
+    
+    def reload_if_changed(self):
+        """Recarregar o modelo apenas se mudou desde o último carregamento
+        
+        Se só o log de gerações cresceu, aplica os registos novos ao modelo
+        em memória em vez de o recarregar.
+        """
+        signature = self._get_model_signature()
+        if signature is None:
+            return False
+        if signature == self._model_signature and self._get_delta_size() == self._delta_offset:
+            return False
+        
+        with self._reload_lock:
+            # Outro pedido pode ter recarregado entretanto
+            if self._get_model_signature() != self._model_signature:
+                return self.load_model()
             
-            # Detectar faces
-            face_locations = face_recognition.face_locations(image, model="hog")
-            if not face_locations:
-                return None, 0.0, "Nenhuma face detectada"
+            delta_size = self._get_delta_size()
+            if delta_size == self._delta_offset:
+                return False
+            if delta_size < self._delta_offset:
+                # Log substituído sem mudar o modelo base: recarregar tudo
+                return self.load_model()
+            return self.apply_deltas()
+    
+    def apply_deltas(self):
+        """Aplicar as gerações novas do log ao modelo em memória"""
+        with self._reload_lock:
+            try:
+                records, offset = read_model_deltas(self.model_path, self._delta_offset)
+                matcher, generation = apply_model_deltas(self._matcher, records, self.generation)
+            except Exception as e:
+                print(f"⚠️ Erro ao aplicar log de gerações: {e}")
+                return self.load_model()
             
-            # Obter encodings das faces detectadas
-            face_encodings = face_recognition.face_encodings(image, face_locations)
-            if not face_encodings:
-                return None, 0.0, "Não foi possível extrair features da face"
+            self._matcher = matcher
+            self.generation = generation
+            self._delta_offset = offset
+            print(f"🔁 Modelo atualizado para a geração {generation}: {len(matcher)} encodings")
+            return True
+    
+    def detection_area_for(self, source, image_shape):
+        """Caixa em pixels da área de deteção da fonte, ou None (imagem inteira)"""
+        area = self.detection_areas.get(source)
+        return area_in_pixels(area, image_shape) if area else None
+    
+    def detect_faces(self, image, max_side=None, scale=None, area=None):
+        """Detetar faces numa cópia reduzida e devolver as caixas na resolução original
+        
+        Com area (top, right, bottom, left em pixels) só essa parte da imagem
+        é analisada; as caixas são devolvidas nas coordenadas da imagem inteira.
+        """
+        top, left = 0, 0
+        if area is not None:
+            top, right, bottom, left = area
+            image = image[top:bottom, left:right]
+        small, factor = downscale_for_detection(image, max_side, scale)
+        face_locations = face_recognition.face_locations(small, model="hog")
+        boxes = [scale_face_location(location, factor, image.shape) for location in face_locations]
+        if top or left:
+            boxes = [(box_top + top, box_right + left, box_bottom + top, box_left + left)
+                     for box_top, box_right, box_bottom, box_left in boxes]
+        return boxes
+    
+    def recognize_faces_in_image(self, image_path, source=None):
+        """Reconhecer todas as faces numa imagem
+        
+        Devolve (faces, mensagem); cada face é um dict com box (top, right,
+        bottom, left), name, confidence e encoding. Todas as faces são
+        comparadas com o modelo numa única chamada vetorizada. Se a fonte
+        tiver uma área de deteção configurada só essa área é analisada.
+        
+        Imagens iguais (mesmo conteúdo) ou quase iguais (hash perceptual) às
+        processadas há menos de RESULT_CACHE_TTL segundos devolvem o resultado
+        anterior sem deteção nem encoding.
+        """
+        matcher = self._matcher
+        if len(matcher) == 0:
+            return [], "Modelo não carregado"
+        
+        try:
+            # Ficheiro idêntico a um recente: nem é preciso descodificar
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            key = content_hash(data)
+            cached = self.result_cache.get(key, source, matcher)
+            if cached is not None:
+                return self._cached_result(cached)
             
-            # Usar primeira face detectada
-            face_encoding = face_encodings[0]
-            face_location = face_locations[0]
+            # Carregar imagem
+            image = face_recognition.load_image_file(io.BytesIO(data))
+            area = self.detection_area_for(source, image.shape)
             
-            # Comparar com faces conhecidas
-            face_distances = face_recognition.face_distance(self.known_encodings, face_encoding)
-            min_distance = np.min(face_distances)
-            confidence = 1 - min_distance
+            # Frame quase igual a um recente (só a área analisada conta)
+            phash = None
+            if self.result_cache.similar_enabled:
+                top, right, bottom, left = area or (0, image.shape[1], image.shape[0], 0)
+                phash = perceptual_hash(image[top:bottom, left:right])
+            cached = self.result_cache.get_similar(phash, image.shape, source, matcher)
+            if cached is not None:
+                return self._cached_result(cached)
             
-            if confidence > self.confidence_threshold:
-                best_match_index = np.argmin(face_distances)
-                name = self.known_names[best_match_index]
-                return name, confidence, f"Face reconhecida: {name}"
-            else:
-                return "Desconhecido", confidence, f"Face detectada mas não reconhecida (confiança: {confidence:.2f})"
+            result = self._recognize(image, area, matcher)
+            self.result_cache.put(key, phash, image.shape, source, matcher, result)
+            return self._cached_result(result)
         
         except Exception as e:
-            return None, 0.0, f"Erro no processamento: {str(e)}"
+            return [], f"Erro no processamento: {str(e)}"
+    
+    def _recognize(self, image, area, matcher):
+        """Deteção, encoding e comparação de uma imagem já carregada"""
+        # Detectar faces (só na área configurada para a fonte, se existir)
+        face_locations = self.detect_faces(image, area=area)
+        if not face_locations:
+            return [], "Nenhuma face detectada"
+        
+        # Obter encodings das faces detectadas (na resolução original)
+        face_encodings = face_recognition.face_encodings(image, face_locations)
+        if not face_encodings:
+            return [], "Não foi possível extrair features da face"
+        
+        faces = self.match_faces(face_locations, face_encodings, matcher)
+        return faces, f"{len(faces)} face(s) detectada(s)"
+    
+    @staticmethod
+    def _cached_result(result):
+        """Cópia das faces, para quem recebe o resultado o poder alterar"""
+        faces, message = result
+        return [dict(face) for face in faces], message
+    
+    def match_faces(self, face_locations, face_encodings, matcher=None):
+        """Comparar encodings já calculados com o modelo (todas as faces de uma vez)
+        
+        Devolve a lista de faces (box, name, confidence, encoding).
+        """
+        matcher = self._matcher if matcher is None else matcher
+        if len(matcher) == 0 or len(face_encodings) == 0:
+            return []
+        
+        matches = matcher.match(face_encodings)
+        
+        faces = []
+        for face_location, face_encoding, match in zip(face_locations, face_encodings, matches):
+            confidence = 1 - match['distance']
+            faces.append({
+                'box': tuple(int(v) for v in face_location),
+                'name': match['name'] if confidence > self.confidence_threshold else "Desconhecido",
+                'confidence': confidence,
+                'encoding': face_encoding
+            })
+        return faces
+    
+    def recognize_face_in_image(self, image_path):
+        """Reconhecer face numa imagem (apenas a primeira face detectada)"""
+        faces, message = self.recognize_faces_in_image(image_path)
+        if not faces:
+            return None, 0.0, message
+        
+        # Usar primeira face detectada
+        face = faces[0]
+        name, confidence = face['name'], face['confidence']
+        
+        if name != "Desconhecido":
+            return name, confidence, f"Face reconhecida: {name}"
+        else:
+            return "Desconhecido", confidence, f"Face detectada mas não reconhecida (confiança: {confidence:.2f})"
     
     def save_detection(self, image_path, detected_name, confidence, status_message):
         """Salvar detecção na base de dados"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Encontrar ID da pessoa se conhecida
-        person_id = None
-        if detected_name and detected_name != "Desconhecido":
-            cursor.execute("SELECT id FROM people WHERE name = ?", (detected_name,))
-            result = cursor.fetchone()
-            if result:
-                person_id = result[0]
-        
-        # Inserir detecção
-        cursor.execute("""
-            INSERT INTO detections (image_path, detected_person_id, detected_name, confidence_score)
-            VALUES (?, ?, ?, ?)
-        """, (image_path, person_id, detected_name, confidence))
-        
-        detection_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        def insert(cursor):
+            # Encontrar ID da pessoa se conhecida
+            person_id = None
+            if detected_name and detected_name != "Desconhecido":
+                cursor.execute("SELECT id FROM people WHERE name = ?", (detected_name,))
+                result = cursor.fetchone()
+                if result:
+                    person_id = result[0]
+            
+            # Inserir detecção
+            cursor.execute("""
+                INSERT INTO detections (image_path, detected_person_id, detected_name, confidence_score)
+                VALUES (?, ?, ?, ?)
+            """, (image_path, person_id, detected_name, confidence))
+            return cursor.lastrowid
+        
+        detection_id = self.db.transaction(insert)
         
         print(f"💾 Detecção salva (ID: {detection_id})")
         return detection_id
+    
+    def save_detections(self, image_path, faces, source='file'):
+        """Salvar uma detecção por face numa única transação"""
+        if not faces:
+            return []
+        
+        timestamp = datetime.now().isoformat()
+        
+        def insert(cursor):
+            # Resolver IDs de todas as pessoas conhecidas numa só consulta
+            known_names = sorted({face['name'] for face in faces if face['name'] != "Desconhecido"})
+            person_ids = {}
+            if known_names:
+                placeholders = ','.join(['?'] * len(known_names))
+                cursor.execute(f"SELECT name, id FROM people WHERE name IN ({placeholders})", known_names)
+                person_ids = dict(cursor.fetchall())
+            
+            detection_ids = []
+            for face in faces:
+                cursor.execute("""
+                    INSERT INTO detections (image_path, detected_person_id, detected_name, confidence_score,
+                                            timestamp, source, is_verified, face_location, face_encoding)
+                    VALUES (?, ?, ?, ?, ?, ?, FALSE, ?, ?)
+                """, (image_path, person_ids.get(face['name']), face['name'], face['confidence'],
+                      timestamp, source, ','.join(str(v) for v in face['box']),
+                      pack_encoding(face['encoding']) if face.get('encoding') is not None else None))
+                detection_ids.append(cursor.lastrowid)
+            return detection_ids
+        
+        detection_ids = self.db.transaction(insert)
+        
+        print(f"💾 {len(detection_ids)} detecções salvas (IDs: {detection_ids})")
+        return detection_ids
+    
+    def save_repeats(self, repeats):
+        """Somar repetições a detecções já guardadas ({id: repetições}) numa só transação"""
+        if not repeats:
+            return
+        
+        timestamp = datetime.now().isoformat()
+        self.db.executemany("""
+            UPDATE detections SET repeat_count = IFNULL(repeat_count, 1) + ?, last_seen = ?
+            WHERE id = ?
+        """, [(count, timestamp, detection_id) for detection_id, count in repeats.items()])
 
 if __name__ == "__main__":
     # Teste básico
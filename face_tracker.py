@@ -0,0 +1,110 @@
+# face_tracker.py - Seguimento de faces entre frames (IoU + centróide)
+import itertools
+
+
+def box_iou(a, b):
+    """IoU entre duas caixas (top, right, bottom, left)"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    area = lambda box: (box[2] - box[0]) * (box[1] - box[3])
+    union = area(a) + area(b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def centroid_distance(a, b):
+    """Distância entre os centros de duas caixas, relativa ao tamanho da primeira"""
+    size = max(a[2] - a[0], a[1] - a[3], 1)
+    dy = (a[0] + a[2] - b[0] - b[2]) / 2
+    dx = (a[1] + a[3] - b[1] - b[3]) / 2
+    return (dx * dx + dy * dy) ** 0.5 / size
+
+
+class Track:
+    """Uma face seguida ao longo dos frames; face guarda o resultado do reconhecimento"""
+
+    def __init__(self, track_id, box, timestamp):
+        self.id = track_id
+        self.box = box
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.hits = 1
+        self.face = None
+        # Encoding em curso e tentativas falhadas (ver video_stream.StreamProcessor)
+        self.encoding = False
+        self.attempts = 0
+
+    @property
+    def identified(self):
+        return self.face is not None
+
+
+class IoUTracker:
+    """Associar as caixas de cada frame às faces já seguidas
+
+    Primeiro por IoU (maior sobreposição primeiro) e, para as que sobram,
+    pelo centro mais próximo (movimentos rápidos entre frames amostrados).
+    Faces não vistas há mais de max_age segundos deixam de ser seguidas.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=2.0, max_centroid_distance=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.max_centroid_distance = max_centroid_distance
+        self.tracks = {}
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def keep_alive(self, timestamp):
+        """Frame sem alterações (ex.: sem movimento): as faces seguidas continuam no mesmo sítio"""
+        for track in self.tracks.values():
+            track.last_seen = timestamp
+
+    def update(self, boxes, timestamp):
+        """Atualizar com as caixas de um frame
+
+        Devolve (track de cada caixa, tracks novos, tracks expirados).
+        """
+        expired = [track for track in self.tracks.values() if timestamp - track.last_seen > self.max_age]
+        for track in expired:
+            del self.tracks[track.id]
+
+        assigned = [None] * len(boxes)
+        free = set(self.tracks)
+
+        pairs = sorted(((box_iou(track.box, box), track_id, i)
+                        for track_id, track in self.tracks.items()
+                        for i, box in enumerate(boxes)), reverse=True)
+        for iou, track_id, i in pairs:
+            if iou < self.iou_threshold:
+                break
+            if track_id in free and assigned[i] is None:
+                free.discard(track_id)
+                assigned[i] = self.tracks[track_id]
+
+        pairs = sorted((centroid_distance(self.tracks[track_id].box, box), track_id, i)
+                       for track_id in free
+                       for i, box in enumerate(boxes) if assigned[i] is None)
+        for distance, track_id, i in pairs:
+            if distance > self.max_centroid_distance:
+                break
+            if track_id in free and assigned[i] is None:
+                free.discard(track_id)
+                assigned[i] = self.tracks[track_id]
+
+        new_tracks = []
+        for i, box in enumerate(boxes):
+            track = assigned[i]
+            if track is None:
+                track = Track(next(self._ids), box, timestamp)
+                self.tracks[track.id] = track
+                assigned[i] = track
+                new_tracks.append(track)
+            else:
+                track.box = box
+                track.last_seen = timestamp
+                track.hits += 1
+
+        return assigned, new_tracks, expired
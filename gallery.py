@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# gallery.py - Compactação da galeria: poucos protótipos por pessoa em vez de todos os encodings
+import argparse
+from contextlib import nullcontext
+import numpy as np
+from config import config
+from face_matcher import ENCODING_SIZE
+from face_index import kmeans, _sq_distances, build_index_for_model
+from model_store import open_model_with_deltas, write_model, retrain_lock, RetrainInProgressError
+
+METHODS = ('kmeans', 'medoids')
+
+
+def person_prototypes(encodings, n_prototypes, method='kmeans', seed=0):
+    """Reduzir os encodings de uma pessoa a n_prototypes representantes
+
+    kmeans devolve os centróides; medoids devolve, para cada centróide, o
+    encoding real mais próximo (nunca cria um vetor que não foi observado).
+    Pessoas com n_prototypes encodings ou menos ficam como estão.
+    """
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    if n_prototypes <= 0 or len(encodings) <= n_prototypes:
+        return encodings
+
+    centroids = kmeans(encodings, n_prototypes, seed=seed)
+    if method == 'medoids':
+        nearest = np.argmin(_sq_distances(centroids, encodings), axis=1)
+        return encodings[np.unique(nearest)]
+    return centroids.astype(np.float32)
+
+
+def compact_gallery(matcher, n_prototypes=None, method=None):
+    """Novo FaceMatcher com no máximo n_prototypes linhas por pessoa"""
+    n_prototypes = config.GALLERY_PROTOTYPES if n_prototypes is None else n_prototypes
+    method = method or config.GALLERY_PROTOTYPE_METHOD
+    if method not in METHODS:
+        raise ValueError(f"Método de protótipos não suportado: {method}")
+    if n_prototypes <= 0 or len(matcher) == 0:
+        return matcher
+
+    ends = np.r_[matcher.label_starts[1:], len(matcher)].astype(np.intp)
+    updates = {}
+    for label, name in enumerate(matcher.label_names):
+        start, end = matcher.label_starts[label], ends[label]
+        if end - start > n_prototypes:
+            updates[name] = person_prototypes(matcher.encodings[start:end], n_prototypes, method, seed=label)
+
+    return matcher.with_people(updates) if updates else matcher
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compactar a galeria de um modelo em protótipos por pessoa")
+    parser.add_argument('model', nargs='?', default=config.MODEL_PATH)
+    parser.add_argument('--prototypes', type=int, default=None,
+                        help="Protótipos por pessoa (padrão: GALLERY_PROTOTYPES)")
+    parser.add_argument('--method', choices=METHODS, default=None,
+                        help="kmeans (centróides) ou medoids (encodings reais)")
+    parser.add_argument('--out', help="Destino (padrão: substituir o modelo)")
+    args = parser.parse_args()
+
+    n_prototypes = config.GALLERY_PROTOTYPES if args.prototypes is None else args.prototypes
+    if n_prototypes <= 0:
+        parser.error("indique --prototypes ou defina GALLERY_PROTOTYPES")
+
+    out_path = args.out or args.model
+    try:
+        # Ler e reescrever sob o lock: nenhuma geração é anexada entretanto
+        with retrain_lock(args.model), retrain_lock(out_path) if out_path != args.model else nullcontext():
+            matcher, metadata, generation, _ = open_model_with_deltas(args.model, use_mmap=False)
+            compacted = compact_gallery(matcher, n_prototypes, args.method)
+            metadata.update({
+                'generation': generation,
+                'prototypes': n_prototypes,
+                'source_encodings': len(matcher),
+            })
+            build_index_for_model(compacted, out_path)
+            write_model(out_path, compacted, metadata)
+    except RetrainInProgressError as e:
+        parser.exit(1, f"⏳ {e} - tente mais tarde\n")
+    print(f"🗜️ Galeria compactada: {len(matcher)} -> {len(compacted)} encodings "
+          f"({len(compacted.label_names)} pessoas, {n_prototypes} protótipos)")
+    print("ℹ️ Compare a precisão com: python benchmark.py gallery --model <modelo>")
@@ -1,16 +1,26 @@
 # ha_integration.py
 import requests
 import json
+import queue
+import threading
+import time
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 
 class HomeAssistantIntegration:
-    def __init__(self, ha_url, ha_token=None):
+    def __init__(self, ha_url, ha_token=None, timeout=5):
         self.ha_url = ha_url.rstrip('/')
         self.ha_token = ha_token
+        self.timeout = timeout
         self.headers = {
             'Authorization': f'Bearer {ha_token}' if ha_token else None,
             'Content-Type': 'application/json',
         }
+        
+        # Sessão com pool de ligações (keep-alive) reutilizada entre pedidos
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
     
     def speak_on_nest_hub(self, message, entity_id="media_player.hub"):
         """Falar mensagem no Nest Hub via TTS"""
@@ -25,7 +35,7 @@ class HomeAssistantIntegration:
         }
         
         try:
-            response = requests.post(url, headers=self.headers, json=data)
+            response = self.session.post(url, headers=self.headers, json=data, timeout=self.timeout)
             if response.status_code == 200:
                 print(f"🔊 Mensagem enviada para Nest Hub: '{message}'")
                 return True
@@ -46,23 +56,122 @@ class HomeAssistantIntegration:
         }
         
         try:
-            response = requests.post(url, headers=self.headers, json=data)
+            response = self.session.post(url, headers=self.headers, json=data, timeout=self.timeout)
             return response.status_code == 200
         except:
             return False
     
-    def get_greeting_message(self, person_name):
-        """Gerar mensagem de saudação"""
+    def get_time_greeting(self):
+        """Saudação de acordo com a hora do dia"""
         hour = datetime.now().hour
         
         if 5 <= hour < 12:
-            greeting = "Bom dia"
+            return "Bom dia"
         elif 12 <= hour < 18:
-            greeting = "Boa tarde"
+            return "Boa tarde"
         else:
-            greeting = "Boa noite"
+            return "Boa noite"
+    
+    def get_greeting_message(self, person_name):
+        """Gerar mensagem de saudação"""
+        greeting = self.get_time_greeting()
         
         if person_name and person_name != "Desconhecido":
             return f"{greeting}, {person_name}!"
         else:
-            return f"{greeting}! Não te reconheço."
\ No newline at end of file
+            return f"{greeting}! Não te reconheço."
+    
+    def get_group_greeting_message(self, person_names):
+        """Gerar uma única saudação para várias pessoas reconhecidas"""
+        greeting = self.get_time_greeting()
+        
+        if len(person_names) == 1:
+            return f"{greeting}, {person_names[0]}!"
+        return f"{greeting}, {', '.join(person_names[:-1])} e {person_names[-1]}!"
+
+
+class NotificationDispatcher:
+    """Envio de saudações (TTS + notificação) ao Home Assistant numa thread de fundo
+    
+    O ciclo de reconhecimento só coloca trabalho numa fila limitada e nunca
+    espera pelo HA. Saudações repetidas para o mesmo destino dentro da janela
+    de coalescência são descartadas; falhas são repetidas com backoff exponencial.
+    """
+    
+    def __init__(self, ha, max_queue=100, max_retries=3, retry_backoff=1.0, coalesce_seconds=30):
+        self.ha = ha
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.coalesce_seconds = coalesce_seconds
+        self.recent = {}  # (entity_id, mensagem) -> instante em que foi aceite
+        self.lock = threading.Lock()
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'retries': 0, 'coalesced': 0, 'dropped': 0}
+        
+        self.thread = threading.Thread(target=self._run, name="ha-dispatcher", daemon=True)
+        self.thread.start()
+    
+    def submit_greeting(self, message, entity_id, title=None, notification=None):
+        """Colocar saudação na fila (não bloqueia); devolve True se foi aceite"""
+        key = (entity_id, message)
+        now = time.monotonic()
+        
+        with self.lock:
+            last = self.recent.get(key)
+            if last is not None and now - last < self.coalesce_seconds:
+                self.stats['coalesced'] += 1
+                return False
+            
+            try:
+                self.queue.put_nowait((message, entity_id, title, notification))
+            except queue.Full:
+                self.stats['dropped'] += 1
+                print(f"⚠️ Fila do HA cheia - saudação descartada: '{message}'")
+                return False
+            
+            self.recent[key] = now
+            self.stats['queued'] += 1
+            
+            # Limpar entradas antigas da janela de coalescência
+            if len(self.recent) > 1000:
+                self.recent = {k: t for k, t in self.recent.items() if now - t < self.coalesce_seconds}
+        
+        return True
+    
+    def _with_retry(self, func, *args):
+        """Executar chamada ao HA com tentativas e backoff exponencial"""
+        for attempt in range(self.max_retries + 1):
+            if func(*args):
+                return True
+            if attempt < self.max_retries:
+                self.stats['retries'] += 1
+                time.sleep(self.retry_backoff * (2 ** attempt))
+        return False
+    
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                message, entity_id, title, notification = job
+                if self._with_retry(self.ha.speak_on_nest_hub, message, entity_id):
+                    self.stats['sent'] += 1
+                    if notification:
+                        self._with_retry(self.ha.send_notification, title or "Face Recognition", notification)
+                else:
+                    self.stats['failed'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                print(f"❌ Erro no envio para o HA: {e}")
+            finally:
+                self.queue.task_done()
+    
+    def flush(self):
+        """Esperar que a fila seja esvaziada"""
+        self.queue.join()
+    
+    def close(self):
+        """Terminar a thread depois de enviar o que está em fila"""
+        self.queue.put(None)
+        self.thread.join()
\ No newline at end of file
@@ -19,7 +19,7 @@ class FaceRecognitionSystem:
         self.ha = HomeAssistantIntegration(HA_URL, HA_TOKEN)
         
         # Verificar se modelo está carregado
-        if not self.recognizer.known_encodings:
+        if not self.recognizer.is_model_loaded():
             print("❌ Modelo não carregado! Execute o treino primeiro.")
             sys.exit(1)
     
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# model_store.py - Formato binário do modelo (mmap) e compatibilidade com pickle
+import json
+import os
+import pickle
+import struct
+import sys
+from contextlib import contextmanager
+import numpy as np
+from face_matcher import FaceMatcher, ENCODING_SIZE
+
+try:
+    import fcntl
+except ImportError:  # Windows: só o guarda dentro do processo (retrain_jobs.py)
+    fcntl = None
+
+# Layout do ficheiro (little-endian):
+#   MAGIC (8 bytes) | versão (u32) | tamanho do cabeçalho JSON (u32) | cabeçalho JSON
+#   secções alinhadas a 64 bytes: encodings float32 (N x 128), labels int32 (N),
+#   sq_norms float32 (N), label_starts int64 (P)
+# As linhas estão agrupadas por pessoa, tal como no FaceMatcher, pelo que abrir
+# o modelo é só mapear as secções - sem deserializar nem recalcular nada.
+MAGIC = b'FACEMDL\x00'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+PREAMBLE = struct.Struct('<8sII')
+
+# Log de gerações (<modelo>.delta): atualizações incrementais anexadas ao
+# modelo base, cada registo = DELTA_RECORD | cabeçalho JSON | encodings float32.
+# O cabeçalho indica a geração e as pessoas alteradas (nome, nº de linhas;
+# 0 remove a pessoa). O modelo base guarda em metadata['generation'] a última
+# geração já incluída, e os registos até essa geração são ignorados.
+DELTA_MAGIC = b'FDLT'
+DELTA_RECORD = struct.Struct('<4sII')
+
+SECTIONS = (
+    ('encodings', np.float32, lambda n, p: (n, ENCODING_SIZE)),
+    ('labels', np.int32, lambda n, p: (n,)),
+    ('sq_norms', np.float32, lambda n, p: (n,)),
+    ('label_starts', np.int64, lambda n, p: (p,)),
+)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_binary_model(path):
+    """Verificar se o ficheiro está no formato binário"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_model(path, matcher, metadata=None):
+    """Guardar o FaceMatcher no formato binário (escrita atómica)"""
+    n, p = len(matcher), len(matcher.label_names)
+    # O modelo novo inclui (ou substitui) todas as gerações anteriores
+    metadata = dict(metadata or {})
+    metadata.setdefault('generation', latest_generation(path))
+    arrays = {
+        'encodings': matcher.encodings,
+        'labels': matcher.labels,
+        'sq_norms': matcher.sq_norms,
+        'label_starts': matcher.label_starts,
+    }
+
+    header = {
+        'version': FORMAT_VERSION,
+        'count': n,
+        'dim': ENCODING_SIZE,
+        'label_names': matcher.label_names,
+        'metadata': metadata,
+        'sections': {},
+    }
+
+    # O cabeçalho contém os offsets, que dependem do tamanho do cabeçalho:
+    # reservar espaço com offsets provisórios e recalcular até estabilizar
+    header_len = 0
+    while True:
+        offset = _align(PREAMBLE.size + header_len)
+        for name, dtype, shape in SECTIONS:
+            header['sections'][name] = offset
+            offset = _align(offset + int(np.prod(shape(n, p))) * np.dtype(dtype).itemsize)
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        if len(header_bytes) <= header_len:
+            break
+        header_len = len(header_bytes) + 32
+    header_bytes = header_bytes.ljust(header_len, b' ')
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, header_len))
+        f.write(header_bytes)
+        for name, dtype, shape in SECTIONS:
+            f.seek(header['sections'][name])
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+
+    delta_path = delta_path_for(path)
+    if os.path.exists(delta_path):
+        os.remove(delta_path)
+
+
+def _open_binary(path, use_mmap):
+    with open(path, 'rb') as f:
+        magic, version, header_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Versão do modelo não suportada: {version}")
+        header = json.loads(f.read(header_len).decode('utf-8'))
+
+    n, p = header['count'], len(header['label_names'])
+    arrays = {}
+    for name, dtype, shape in SECTIONS:
+        offset = header['sections'][name]
+        if n == 0:
+            arrays[name] = np.empty(shape(n, p), dtype=dtype)
+        elif use_mmap:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape(n, p))
+        else:
+            arrays[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape(n, p))),
+                                       offset=offset).reshape(shape(n, p))
+
+    matcher = FaceMatcher.from_arrays(arrays['encodings'], arrays['labels'], header['label_names'],
+                                      arrays['sq_norms'], arrays['label_starts'])
+    return matcher, header['metadata']
+
+
+def open_model(path, use_mmap=None):
+    """Abrir modelo (binário ou pickle antigo); devolve (FaceMatcher, metadados)
+
+    No formato binário os encodings são mapeados em memória. Em Windows um
+    ficheiro mapeado não pode ser substituído, por isso aí é lido para memória.
+    """
+    if use_mmap is None:
+        use_mmap = os.name != 'nt'
+
+    if is_binary_model(path):
+        return _open_binary(path, use_mmap)
+
+    with open(path, 'rb') as f:
+        model_data = pickle.load(f)
+    metadata = {k: v for k, v in model_data.items() if k not in ('encodings', 'names')}
+    return FaceMatcher(model_data['encodings'], model_data['names']), metadata
+
+
+def delta_path_for(model_path):
+    return f"{model_path}.delta"
+
+
+def model_generation(path):
+    """Geração do modelo base (0 se não existir ou não tiver)"""
+    if not os.path.exists(path) or not is_binary_model(path):
+        return 0
+    with open(path, 'rb') as f:
+        _, _, header_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    return header['metadata'].get('generation', 0)
+
+
+def read_model_deltas(model_path, offset=0):
+    """Ler os registos completos do log a partir de offset
+
+    Devolve (registos, offset do fim do último registo completo); cada registo
+    é (cabeçalho, {nome: encodings}). Um registo a meio de ser escrito fica
+    para a próxima leitura.
+    """
+    records = []
+    try:
+        f = open(delta_path_for(model_path), 'rb')
+    except FileNotFoundError:
+        return records, 0
+
+    with f:
+        f.seek(offset)
+        while True:
+            preamble = f.read(DELTA_RECORD.size)
+            if len(preamble) < DELTA_RECORD.size:
+                break
+            magic, header_len, payload_len = DELTA_RECORD.unpack(preamble)
+            if magic != DELTA_MAGIC:
+                raise ValueError(f"Log de gerações corrompido em {offset}")
+            header_bytes = f.read(header_len)
+            payload = f.read(payload_len)
+            if len(header_bytes) < header_len or len(payload) < payload_len:
+                break
+
+            header = json.loads(header_bytes.decode('utf-8'))
+            encodings = np.frombuffer(payload, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            updates, row = {}, 0
+            for name, count in header['people']:
+                updates[name] = encodings[row:row + count]
+                row += count
+            records.append((header, updates))
+            offset += DELTA_RECORD.size + header_len + payload_len
+    return records, offset
+
+
+def latest_generation(model_path):
+    """Última geração do modelo: a do log se existir, senão a do modelo base"""
+    records, _ = read_model_deltas(model_path)
+    generations = [header['generation'] for header, _ in records]
+    return max([model_generation(model_path)] + generations)
+
+
+class RetrainInProgressError(RuntimeError):
+    """Já existe um retreino (ou outra escrita do modelo) a decorrer, neste ou noutro processo"""
+
+
+@contextmanager
+def retrain_lock(model_path, wait=False):
+    """Lock exclusivo entre processos (ficheiro ao lado do modelo) para quem escreve o modelo
+
+    Todas as escritas do modelo base e do log de gerações (retreino, treino,
+    compactação da galeria) têm de o ter. Sem wait levanta
+    RetrainInProgressError se estiver ocupado; com wait espera pela escrita em curso.
+    """
+    lock_path = f"{model_path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not wait:
+                    raise RetrainInProgressError("Já existe um retreino a decorrer")
+                print("⏳ À espera do retreino em curso...")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def append_model_delta(model_path, updates, metadata=None):
+    """Anexar uma geração ao log: {nome: encodings (k x 128)}; k = 0 remove a pessoa
+
+    Só as linhas destas pessoas são escritas. Devolve (geração, nº de registos no log).
+    Quem escreve deve ter o retrain_lock.
+    """
+    records, end = read_model_deltas(model_path)
+    generation = max([model_generation(model_path)] + [h['generation'] for h, _ in records]) + 1
+
+    blocks = [(name, np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE))
+              for name, encodings in updates.items()]
+    header = {
+        'generation': generation,
+        'people': [[name, len(encodings)] for name, encodings in blocks],
+        'metadata': metadata or {},
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    payload = b''.join(np.ascontiguousarray(encodings, dtype='<f4').tobytes() for _, encodings in blocks)
+
+    with open(delta_path_for(model_path), 'ab') as f:
+        # Descartar um registo incompleto deixado por uma escrita interrompida
+        f.truncate(end)
+        f.write(DELTA_RECORD.pack(DELTA_MAGIC, len(header_bytes), len(payload)))
+        f.write(header_bytes)
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    return generation, len(records) + 1
+
+
+def apply_model_deltas(matcher, records, after_generation=0):
+    """Aplicar ao matcher as gerações posteriores a after_generation
+
+    Devolve (matcher, última geração aplicada); o matcher original não é alterado.
+    """
+    generation = after_generation
+    for header, updates in records:
+        if header['generation'] <= generation:
+            continue
+        matcher = matcher.with_people(updates)
+        generation = header['generation']
+    return matcher, generation
+
+
+def open_model_with_deltas(path, use_mmap=None):
+    """Abrir o modelo base e aplicar o log de gerações
+
+    Devolve (matcher, metadados, geração, offset lido do log).
+    """
+    matcher, metadata = open_model(path, use_mmap)
+    records, offset = read_model_deltas(path)
+    matcher, generation = apply_model_deltas(matcher, records, metadata.get('generation', 0))
+    return matcher, metadata, generation, offset
+
+
+def convert_pickle_model(src_path, dst_path=None):
+    """Converter um modelo pickle para o formato binário"""
+    dst_path = dst_path or os.path.splitext(src_path)[0] + '.bin'
+    matcher, metadata = open_model(src_path)
+    metadata['converted_from'] = os.path.basename(src_path)
+    with retrain_lock(dst_path, wait=True):
+        write_model(dst_path, matcher, metadata)
+    print(f"✅ Modelo convertido: {src_path} -> {dst_path} ({len(matcher)} encodings)")
+    return dst_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == 'convert':
+        convert_pickle_model(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        print("Uso:")
+        print("  python model_store.py convert <modelo.pkl> [destino.bin]")
@@ -0,0 +1,110 @@
+# motion.py - Filtro de movimento barato antes da deteção de faces (câmaras fixas)
+import cv2
+import numpy as np
+from config import config
+
+METHODS = ('diff', 'mog2')
+
+
+class MotionGate:
+    """Decidir se um frame tem movimento e onde, numa cópia pequena em tons de cinza
+
+    diff compara com uma média móvel do fundo (accumulateWeighted); mog2 usa
+    o subtrator de fundo do OpenCV (mais robusto a mudanças de luz, mais caro).
+    check() devolve as regiões com movimento na resolução original, ou uma
+    lista vazia se o frame for igual ao fundo. O primeiro frame é sempre
+    considerado movimento (ainda não há fundo), tal como o primeiro depois de
+    o tamanho mudar (ex.: a área de deteção da fonte foi alterada).
+    """
+
+    def __init__(self, threshold=None, min_area=None, method=None, width=None, learning_rate=0.05):
+        self.threshold = config.MOTION_THRESHOLD if threshold is None else threshold
+        self.min_area = config.MOTION_MIN_AREA if min_area is None else min_area
+        self.method = method or config.MOTION_METHOD
+        if self.method not in METHODS:
+            raise ValueError(f"Método de movimento não suportado: {self.method}")
+        self.width = width or config.MOTION_FRAME_WIDTH
+        self.learning_rate = learning_rate
+
+        self._background = None
+        self._subtractor = None
+        self._shape = None
+        self._kernel = np.ones((3, 3), np.uint8)
+
+        self.checked = 0
+        self.still = 0
+
+    def _small_gray(self, frame):
+        height, width = frame.shape[:2]
+        factor = min(1.0, self.width / width)
+        small = cv2.resize(frame, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1.0 else frame
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0), factor
+
+    def _mask(self, gray):
+        """Máscara de movimento; None no primeiro frame"""
+        if self.method == 'mog2':
+            first = self._subtractor is None
+            if first:
+                self._subtractor = cv2.createBackgroundSubtractorMOG2(
+                    history=500, varThreshold=self.threshold, detectShadows=False)
+            mask = self._subtractor.apply(gray)
+            return None if first else mask
+
+        if self._background is None:
+            self._background = gray.astype(np.float32)
+            return None
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        cv2.accumulateWeighted(gray, self._background, self.learning_rate)
+        return cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)[1]
+
+    def check(self, frame):
+        """Regiões (top, right, bottom, left) com movimento; [] se não houver"""
+        self.checked += 1
+        gray, factor = self._small_gray(frame)
+        if self._shape != gray.shape:
+            self._shape, self._background, self._subtractor = gray.shape, None, None
+        mask = self._mask(gray)
+
+        height, width = frame.shape[:2]
+        if mask is None:
+            return [(0, width, height, 0)]
+
+        mask = cv2.dilate(mask, self._kernel, iterations=2)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        min_pixels = self.min_area * mask.shape[0] * mask.shape[1]
+
+        regions = []
+        for x, y, w, h, area in stats[1:count]:
+            if area >= min_pixels:
+                regions.append((
+                    int(y / factor),
+                    min(width, int((x + w) / factor)),
+                    min(height, int((y + h) / factor)),
+                    int(x / factor),
+                ))
+        if not regions:
+            self.still += 1
+        return regions
+
+
+def detection_area(regions, frame_shape, margin=0.5, max_fraction=0.6):
+    """Retângulo (top, right, bottom, left) que cobre as regiões com movimento, com margem
+
+    Uma face pode estar só parcialmente em movimento, por isso cada região é
+    alargada; se o resultado cobrir mais de max_fraction do frame usa-se o
+    frame inteiro (recortar já não poupa nada).
+    """
+    height, width = frame_shape[:2]
+    top = min(region[0] for region in regions)
+    right = max(region[1] for region in regions)
+    bottom = max(region[2] for region in regions)
+    left = min(region[3] for region in regions)
+
+    pad = int(max(bottom - top, right - left) * margin)
+    top, left = max(0, top - pad), max(0, left - pad)
+    bottom, right = min(height, bottom + pad), min(width, right + pad)
+
+    if (bottom - top) * (right - left) > max_fraction * height * width:
+        return (0, width, height, 0)
+    return (top, right, bottom, left)
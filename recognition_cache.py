@@ -0,0 +1,148 @@
+# recognition_cache.py - Cache (LRU com TTL) de resultados de reconhecimento para imagens repetidas
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+from config import config
+
+# Lado da grelha do hash perceptual (dHash): HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 32
+
+# Diferença máxima de brilho (0-255) numa célula da grelha entre frames "iguais":
+# o dHash ignora zonas lisas, uma face nova numa célula muda sempre a sua média
+MAX_CELL_DIFF = 16
+
+
+def content_hash(data):
+    """Hash exato do conteúdo do ficheiro (bytes)"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def perceptual_hash(image):
+    """dHash da imagem numa cópia HASH_SIZE x (HASH_SIZE + 1) em cinza
+
+    Cada bit compara uma célula com a vizinha, por isso frames quase iguais
+    (ruído, compressão) dão hashes a poucos bits de distância. Devolve
+    (hash com HASH_SIZE² bits, células em cinza) - as células servem para
+    confirmar a semelhança em zonas lisas, onde o dHash não vê diferenças.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    cells = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (cells[:, 1:] > cells[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big'), cells
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def similar_frames(a, b, max_distance):
+    """Dois perceptual_hash() do mesmo frame (a menos de ruído)? Devolve a distância ou None"""
+    distance = hamming_distance(a[0], b[0])
+    if distance > max_distance:
+        return None
+    if np.abs(a[1].astype(np.int16) - b[1]).max() > MAX_CELL_DIFF:
+        return None
+    return distance
+
+
+class RecognitionCache:
+    """Resultados recentes de recognize_faces_in_image, por hash exato e perceptual
+
+    Uma entrada só serve para a mesma fonte (área de deteção) e para o mesmo
+    snapshot do modelo (um reload invalida tudo). get() procura o ficheiro
+    idêntico antes de descodificar a imagem; get_similar() procura, já com a
+    imagem descodificada, o frame mais parecido com o mesmo tamanho, a no
+    máximo max_distance bits de distância e sem nenhuma célula com o brilho
+    muito diferente (similar_frames). As entradas expiram ao fim de ttl
+    segundos e as menos usadas saem quando há mais de max_size.
+    """
+
+    def __init__(self, max_size=None, ttl=None, max_distance=None):
+        self.max_size = config.RESULT_CACHE_SIZE if max_size is None else max_size
+        self.ttl = config.RESULT_CACHE_TTL if ttl is None else ttl
+        self.max_distance = config.RESULT_CACHE_MAX_DISTANCE if max_distance is None else max_distance
+        self._entries = OrderedDict()  # hash exato -> (expira em, fonte, modelo, hash perceptual, shape, resultado)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'similar_hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    @property
+    def similar_enabled(self):
+        return self.enabled and self.max_distance > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _valid(self, key, entry, now):
+        if entry[0] < now:
+            del self._entries[key]
+            self.stats['expired'] += 1
+            return False
+        return True
+
+    def get(self, key, source, model):
+        """Resultado guardado para o mesmo ficheiro, ou None (não conta como falha)"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._valid(key, entry, time.monotonic()):
+                return None
+            if entry[1] != source or entry[2] is not model:
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[5]
+
+    def get_similar(self, phash, shape, source, model):
+        """Resultado do frame mais parecido, ou None (conta como falha)"""
+        if not self.similar_enabled or phash is None:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        with self._lock:
+            now = time.monotonic()
+            best_key, best_distance = None, self.max_distance + 1
+            for key, entry in list(self._entries.items()):
+                if not self._valid(key, entry, now):
+                    continue
+                if entry[1] != source or entry[2] is not model or entry[4] != shape:
+                    continue
+                distance = similar_frames(entry[3], phash, self.max_distance)
+                if distance is not None and distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.stats['similar_hits'] += 1
+            return self._entries[best_key][5]
+
+    def put(self, key, phash, shape, source, model, result):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, source, model, phash, shape, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def summary(self):
+        """Linha com as métricas (acertos exatos/parecidos, falhas, taxa)"""
+        hits = self.stats['hits'] + self.stats['similar_hits']
+        total = hits + self.stats['misses']
+        rate = hits / total if total else 0.0
+        return (f"{self.stats['hits']} iguais + {self.stats['similar_hits']} parecidas / {total} imagens "
+                f"({rate:.0%}), {len(self)} em cache, {self.stats['expired']} expiradas, "
+                f"{self.stats['evicted']} removidas")
@@ -0,0 +1,142 @@
+# retrain_jobs.py - Retreino em segundo plano com progresso e um job de cada vez
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+STAGE_LABELS = {
+    'feedback': 'A obter feedback pendente',
+    'encoding': 'A extrair encodings das imagens corrigidas',
+    'updating': 'A atualizar pessoas',
+    'rebuilding': 'A reconstruir o modelo',
+    'finalizing': 'A marcar feedback como processado',
+}
+
+
+class RetrainJob:
+    """Estado de um retreino; version aumenta a cada alteração"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'  # queued, running, succeeded, failed
+        self.stage = None
+        self.done = None
+        self.total = None
+        self.message = 'Em fila'
+        self.error = None
+        self.created_at = datetime.now().isoformat()
+        self.started = None
+        self.finished = None
+        self.version = 0
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        duration = None
+        if self.started:
+            duration = round((self.finished or time.time()) - self.started, 1)
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'done': self.done,
+            'total': self.total,
+            'message': self.message,
+            'error': self.error,
+            'created_at': self.created_at,
+            'duration_seconds': duration,
+            'version': self.version,
+        }
+
+
+class RetrainJobManager:
+    """Executa retreinos numa thread própria, um de cada vez
+
+    create_retrainer(progress) devolve um RetainModel configurado com o callback
+    de progresso; on_success é chamado no fim de um retreino bem sucedido
+    (ex.: recarregar o modelo partilhado da app web).
+    """
+
+    def __init__(self, create_retrainer, on_success=None, keep=20):
+        self.create_retrainer = create_retrainer
+        self.on_success = on_success
+        self.keep = keep
+        self.jobs = OrderedDict()
+        self.current = None
+        self._changed = threading.Condition()
+
+    def submit(self):
+        """Iniciar um retreino; devolve (job, criado). Se já houver um ativo devolve esse"""
+        with self._changed:
+            if self.current and self.current.active:
+                return self.current, False
+
+            job = RetrainJob()
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.keep:
+                self.jobs.popitem(last=False)
+            self.current = job
+
+        threading.Thread(target=self._run, args=(job,), name=f"retrain-{job.id[:8]}", daemon=True).start()
+        return job, True
+
+    def get(self, job_id):
+        with self._changed:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def latest(self):
+        """Estado do último job (ou None)"""
+        with self._changed:
+            return self.current.to_dict() if self.current else None
+
+    def wait_for_change(self, job_id, version, timeout):
+        """Esperar até o job mudar de versão (ou timeout); devolve o estado atual"""
+        with self._changed:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            self._changed.wait_for(lambda: job.version != version, timeout)
+            return job.to_dict()
+
+    def _update(self, job, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.version += 1
+            self._changed.notify_all()
+
+    def _progress(self, job):
+        def report(stage, done=None, total=None):
+            message = STAGE_LABELS.get(stage, stage)
+            if total:
+                message = f"{message} ({done}/{total})"
+            self._update(job, stage=stage, done=done, total=total, message=message)
+        return report
+
+    def _run(self, job):
+        self._update(job, status='running', started=time.time(), message='A iniciar retreino')
+        try:
+            retrainer = self.create_retrainer(self._progress(job))
+            success = retrainer.retrain_with_feedback()
+        except Exception as e:
+            print(f"❌ Erro no retreino {job.id[:8]}: {e}")
+            self._update(job, status='failed', error=str(e), message=f'Erro no retreino: {e}',
+                         finished=time.time())
+            return
+
+        if not success:
+            self._update(job, status='failed', error='Falha no retreino do modelo',
+                         message='Falha no retreino do modelo', finished=time.time())
+            return
+
+        if self.on_success:
+            try:
+                self.on_success()
+            except Exception as e:
+                print(f"⚠️ Erro após retreino: {e}")
+
+        self._update(job, status='succeeded', message='Modelo retreinado com sucesso', finished=time.time())
@@ -1,54 +1,116 @@
 #!/usr/bin/env python3
 # retrain_model.py
-import sqlite3
 import pickle
 import face_recognition
 import numpy as np
 import os
+import shutil
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from train_model import FaceTrainer
+from face_matcher import FaceMatcher, ENCODING_SIZE, unpack_encoding
+from face_index import build_index_for_model
+from model_store import (write_model, append_model_delta, open_model_with_deltas,
+                         retrain_lock, RetrainInProgressError)
+from gallery import compact_gallery, person_prototypes
 from config import config
+from database import get_database, feedback_counts
+from thumbnails import parse_face_location
+
+def encode_feedback_image(task):
+    """Extrair o encoding da face corrigida de uma imagem
+    
+    task = (caminho, caixa ou None). Com a caixa guardada na deteção original
+    (top, right, bottom, left) só é calculado o encoding dessa região, sem
+    voltar a correr o detetor; sem caixa (deteções antigas) deteta a face.
+    Função ao nível do módulo para poder correr nos processos do pool.
+    Devolve (encoding ou None, erro ou None, segundos gastos).
+    """
+    image_path, box = task
+    start = time.perf_counter()
+    try:
+        image = face_recognition.load_image_file(image_path)
+        height, width = image.shape[:2]
+        if box and box[0] >= 0 and box[3] >= 0 and box[2] <= height and box[1] <= width:
+            face_locations = [box]
+        else:
+            face_locations = face_recognition.face_locations(image, model="hog")
+        face_encodings = face_recognition.face_encodings(image, face_locations)
+        encoding = face_encodings[0] if face_encodings else None
+        error = None
+    except Exception as e:
+        encoding, error = None, str(e)
+    return encoding, error, time.perf_counter() - start
 
 class RetainModel:
-    def __init__(self, db_path=None, model_path=None):
+    def __init__(self, db_path=None, model_path=None, progress=None, workers=None):
         self.db_path = db_path or config.DB_PATH
+        self.db = get_database(self.db_path)
         self.model_path = model_path or config.MODEL_PATH
         self.trainer = FaceTrainer(self.db_path)
+        # progress(stage, done, total): chamado em cada passo do retreino
+        self.progress = progress
+        self.workers = workers or config.TRAINING_WORKERS or os.cpu_count()
+    
+    def report(self, stage, done=None, total=None):
+        """Reportar progresso (etapas: feedback, encoding, updating, rebuilding, finalizing)"""
+        if self.progress:
+            self.progress(stage, done, total)
     
     def get_feedback_data(self):
         """Obter dados de feedback não processados"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
+        rows = self.db.fetchall("""
             SELECT f.id, f.detection_id, f.original_prediction, f.correct_prediction, 
-                   f.feedback_type, d.image_path
+                   f.feedback_type, d.image_path, d.face_location, d.face_encoding
             FROM feedback f
             JOIN detections d ON f.detection_id = d.id
             WHERE f.processed = FALSE
         """)
         
         feedback_data = []
-        for row in cursor.fetchall():
+        for row in rows:
             feedback_data.append({
                 'feedback_id': row[0],
                 'detection_id': row[1],
                 'original_prediction': row[2],
                 'correct_prediction': row[3],
                 'feedback_type': row[4],
-                'image_path': row[5]
+                'image_path': row[5],
+                'face_location': parse_face_location(row[6]),
+                'encoding': unpack_encoding(row[7])
             })
         
-        conn.close()
         return feedback_data
     
     def process_corrections(self, feedback_data):
-        """Processar correções e extrair novos encodings"""
+        """Processar correções e obter os encodings das faces corrigidas
+        
+        Usa o encoding guardado com a deteção sempre que existe (sem abrir a
+        imagem). Só as deteções antigas, sem encoding, voltam a ser
+        processadas: num pool de processos (workers) e, se a caixa da face
+        estiver guardada, codificando apenas essa região.
+        """
         corrections = []
+        total = len(feedback_data)
         
+        tasks = []
         for feedback in feedback_data:
-            image_path = feedback['image_path']
             correct_name = feedback['correct_prediction']
+            if correct_name == "Desconhecido":
+                print(f"⚠️ Saltando feedback {feedback['feedback_id']} (nome: {correct_name})")
+                continue
+            
+            if feedback.get('encoding') is not None:
+                corrections.append({
+                    'name': correct_name,
+                    'encoding': feedback['encoding'],
+                    'feedback_id': feedback['feedback_id']
+                })
+                continue
+            
+            image_path = feedback['image_path']
             
             # Construir caminho completo se necessário
             if not os.path.isabs(image_path):
@@ -56,35 +118,60 @@ class RetainModel:
             else:
                 full_image_path = image_path
             
-            if not os.path.exists(full_image_path) or correct_name == "Desconhecido":
-                print(f"⚠️ Saltando: {full_image_path} (existe: {os.path.exists(full_image_path)}, nome: {correct_name})")
+            if not os.path.exists(full_image_path):
+                print(f"⚠️ Saltando: {full_image_path} (existe: False, nome: {correct_name})")
                 continue
             
-            try:
-                # Carregar imagem e extrair encoding
-                image = face_recognition.load_image_file(full_image_path)
-                face_encodings = face_recognition.face_encodings(image)
-                
-                if face_encodings:
-                    corrections.append({
-                        'name': correct_name,
-                        'encoding': face_encodings[0],
-                        'feedback_id': feedback['feedback_id']
-                    })
-                    print(f"✅ Encoding extraído para {correct_name}")
-                else:
-                    print(f"⚠️ Nenhuma face encontrada em {full_image_path}")
-                    
-            except Exception as e:
-                print(f"❌ Erro ao processar {full_image_path}: {e}")
+            tasks.append((feedback, full_image_path))
+        
+        if corrections:
+            print(f"🗃️ {len(corrections)} encodings lidos da base de dados")
+        
+        done = total - len(tasks)
+        self.report('encoding', done, total)
+        
+        start_time = time.perf_counter()
+        results = self._encode_feedback(
+            [(full_image_path, feedback.get('face_location')) for feedback, full_image_path in tasks]
+        )
+        for index, ((feedback, full_image_path), (encoding, error, elapsed)) in enumerate(zip(tasks, results), 1):
+            correct_name = feedback['correct_prediction']
+            if error:
+                print(f"❌ Erro ao processar {full_image_path}: {error}")
+            elif encoding is not None:
+                corrections.append({
+                    'name': correct_name,
+                    # dtype canónico (arrays vindos dos workers trazem o seu próprio)
+                    'encoding': encoding.astype(np.float64),
+                    'feedback_id': feedback['feedback_id']
+                })
+                print(f"✅ Encoding extraído para {correct_name} ({elapsed:.2f}s)")
+            else:
+                print(f"⚠️ Nenhuma face encontrada em {full_image_path}")
+            self.report('encoding', done + index, total)
+        results.close()
         
+        if tasks:
+            print(f"⏱️ {len(tasks)} imagens de feedback sem encoding guardado processadas em {time.perf_counter() - start_time:.1f}s")
+        
+        self.report('encoding', total, total)
         return corrections
     
+    def _encode_feedback(self, tasks):
+        """Gerador de (encoding, erro, tempo) pela ordem de tasks"""
+        if self.workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield encode_feedback_image(task)
+            return
+        
+        # spawn e não fork: o retreino corre numa thread do servidor web e um
+        # fork de um processo com várias threads pode herdar locks bloqueados
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks)),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            yield from executor.map(encode_feedback_image, tasks)
+    
     def update_person_encodings(self, corrections):
         """Atualizar encodings das pessoas com novas correções"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         # Agrupar correções por pessoa
         person_corrections = {}
         for correction in corrections:
@@ -93,80 +180,104 @@ class RetainModel:
                 person_corrections[name] = []
             person_corrections[name].append(correction)
         
-        for person_name, person_corrections_list in person_corrections.items():
-            try:
-                # Obter encoding atual da pessoa
-                cursor.execute("SELECT face_encoding FROM people WHERE name = ?", (person_name,))
-                result = cursor.fetchone()
-                
-                if result:
-                    # Pessoa existe - combinar encodings
-                    current_encoding = pickle.loads(result[0])
-                    new_encodings = [correction['encoding'] for correction in person_corrections_list]
-                    all_encodings = [current_encoding] + new_encodings
-                    
-                    # Calcular encoding médio
-                    avg_encoding = np.mean(all_encodings, axis=0)
+        def update(cursor):
+            for index, (person_name, person_corrections_list) in enumerate(person_corrections.items()):
+                self.report('updating', index, len(person_corrections))
+                try:
+                    # Obter encoding atual da pessoa
+                    cursor.execute("SELECT face_encoding FROM people WHERE name = ?", (person_name,))
+                    result = cursor.fetchone()
                     
-                    # Atualizar na base de dados
-                    cursor.execute("""
-                        UPDATE people 
-                        SET face_encoding = ?, updated_at = ?
-                        WHERE name = ?
-                    """, (pickle.dumps(avg_encoding), datetime.now(), person_name))
+                    if result:
+                        # Pessoa existe - combinar encodings
+                        current_encoding = pickle.loads(result[0])
+                        new_encodings = [correction['encoding'] for correction in person_corrections_list]
+                        all_encodings = [current_encoding] + new_encodings
+                        
+                        # Calcular encoding médio
+                        avg_encoding = np.mean(all_encodings, axis=0)
+                        
+                        # Atualizar na base de dados
+                        cursor.execute("""
+                            UPDATE people 
+                            SET face_encoding = ?, updated_at = ?
+                            WHERE name = ?
+                        """, (pickle.dumps(avg_encoding), datetime.now(), person_name))
+                        
+                        print(f"🔄 Encoding atualizado para {person_name} ({len(new_encodings)} novas amostras)")
                     
-                    print(f"🔄 Encoding atualizado para {person_name} ({len(new_encodings)} novas amostras)")
-                    
-                else:
-                    # Pessoa nova - criar entrada
-                    if len(person_corrections_list) == 1:
-                        encoding = person_corrections_list[0]['encoding']
                     else:
-                        encodings = [correction['encoding'] for correction in person_corrections_list]
-                        encoding = np.mean(encodings, axis=0)
-                    
-                    cursor.execute("""
-                        INSERT INTO people (name, face_encoding)
-                        VALUES (?, ?)
-                    """, (person_name, pickle.dumps(encoding)))
-                    
-                    print(f"➕ Nova pessoa adicionada: {person_name}")
-                    
-            except Exception as e:
-                print(f"❌ Erro ao atualizar {person_name}: {e}")
+                        # Pessoa nova - criar entrada
+                        if len(person_corrections_list) == 1:
+                            encoding = person_corrections_list[0]['encoding']
+                        else:
+                            encodings = [correction['encoding'] for correction in person_corrections_list]
+                            encoding = np.mean(encodings, axis=0)
+                        
+                        cursor.execute("""
+                            INSERT INTO people (name, face_encoding)
+                            VALUES (?, ?)
+                        """, (person_name, pickle.dumps(encoding)))
+                        
+                        print(f"➕ Nova pessoa adicionada: {person_name}")
+                
+                except Exception as e:
+                    print(f"❌ Erro ao atualizar {person_name}: {e}")
+        
+        self.db.transaction(update)
+        self.report('updating', len(person_corrections), len(person_corrections))
+        return list(person_corrections)
+    
+    def person_galleries(self, person_names=None):
+        """Linhas do modelo de cada pessoa: {nome: encodings}
+        
+        Sem protótipos (GALLERY_PROTOTYPES=0) é só o encoding médio da pessoa.
+        Com protótipos junta-se os encodings das deteções confirmadas dessa
+        pessoa e o conjunto é reduzido a GALLERY_PROTOTYPES representantes,
+        mantendo a variedade de poses sem fazer crescer a matriz.
+        """
+        name_filter, params = '', []
+        if person_names is not None:
+            name_filter = f"AND p.name IN ({','.join(['?'] * len(person_names))})"
+            params = list(person_names)
+        
+        galleries = {}
+        for name, encoding in self.db.fetchall(
+                f"SELECT p.name, p.face_encoding FROM people p WHERE 1 = 1 {name_filter}", params):
+            galleries[name] = [pickle.loads(encoding)]
+        
+        if config.GALLERY_PROTOTYPES <= 0:
+            return {name: np.asarray(encodings) for name, encodings in galleries.items()}
+        
+        rows = self.db.fetchall(f"""
+            SELECT p.name, d.face_encoding
+            FROM detections d
+            JOIN people p ON p.id = d.correct_person_id
+            WHERE d.is_verified = TRUE AND d.face_encoding IS NOT NULL {name_filter}
+        """, params)
+        for name, blob in rows:
+            encoding = unpack_encoding(blob)
+            if encoding is not None and name in galleries:
+                galleries[name].append(encoding)
         
-        conn.commit()
-        conn.close()
+        return {name: person_prototypes(encodings, config.GALLERY_PROTOTYPES, config.GALLERY_PROTOTYPE_METHOD)
+                for name, encodings in galleries.items()}
     
     def rebuild_model(self):
         """Reconstruir modelo com todos os dados atualizados"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Obter todas as pessoas e seus encodings
-            cursor.execute("SELECT name, face_encoding FROM people")
+            galleries = self.person_galleries()
             
             all_encodings = []
             all_names = []
-            
-            for row in cursor.fetchall():
-                name = row[0]
-                encoding = pickle.loads(row[1])
-                
-                # Para cada pessoa, adicionar encoding múltiplas vezes para balanceamento
-                # (simula ter múltiplas fotos de treino)
-                for _ in range(3):  # Replicar 3 vezes
-                    all_encodings.append(encoding)
-                    all_names.append(name)
-            
-            conn.close()
+            for name, encodings in galleries.items():
+                all_encodings.extend(encodings)
+                all_names.extend([name] * len(encodings))
             
             if all_encodings:
                 # Salvar modelo atualizado
-                model_data = {
-                    'encodings': all_encodings,
-                    'names': all_names,
+                matcher = FaceMatcher(all_encodings, all_names)
+                metadata = {
                     'training_date': datetime.now().isoformat(),
                     'retrain_count': getattr(self, 'retrain_count', 0) + 1
                 }
@@ -174,13 +285,17 @@ class RetainModel:
                 # Criar backup do modelo anterior
                 if os.path.exists(self.model_path):
                     backup_path = f"{self.model_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                    os.rename(self.model_path, backup_path)
+                    shutil.copy2(self.model_path, backup_path)
                     print(f"💾 Backup criado: {backup_path}")
                 
                 # Salvar novo modelo
                 os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
-                with open(self.model_path, 'wb') as f:
-                    pickle.dump(model_data, f)
+                # Índice ANN opcional (escrito antes do modelo)
+                build_index_for_model(matcher, self.model_path)
+                
+                # Substituição atómica: o FaceRecognizer partilhado da app web
+                # deteta a alteração e recarrega sem ver um ficheiro parcial
+                write_model(self.model_path, matcher, metadata)
                 
                 print(f"🎉 Modelo retreinado com {len(set(all_names))} pessoas e {len(all_encodings)} encodings")
                 return True
@@ -192,31 +307,79 @@ class RetainModel:
             print(f"❌ Erro ao reconstruir modelo: {e}")
             return False
     
+    def update_model(self, person_names):
+        """Atualizar só as pessoas alteradas, anexando uma geração ao log do modelo
+        
+        Lê da base de dados apenas estas pessoas e escreve as suas linhas no
+        log (<modelo>.delta); o FaceRecognizer em execução aplica-as sem
+        recarregar o modelo. Sem modelo base faz a reconstrução completa, e a
+        cada MODEL_DELTA_MAX_GENERATIONS gerações o log é compactado no modelo.
+        """
+        if not os.path.exists(self.model_path):
+            return self.rebuild_model()
+        
+        try:
+            # Pessoas que já não existem na base de dados saem do modelo
+            updates = {name: np.empty((0, ENCODING_SIZE)) for name in person_names}
+            updates.update(self.person_galleries(person_names))
+            
+            generation, pending = append_model_delta(self.model_path, updates, {
+                'training_date': datetime.now().isoformat(),
+            })
+            print(f"🧩 Geração {generation}: {len(updates)} pessoas atualizadas no modelo")
+            
+            if pending >= config.MODEL_DELTA_MAX_GENERATIONS:
+                self.compact_model()
+            return True
+        
+        except Exception as e:
+            print(f"❌ Erro ao atualizar modelo: {e}")
+            return False
+    
+    def compact_model(self):
+        """Reescrever o modelo base com todas as gerações do log (e reconstruir o índice ANN)"""
+        matcher, metadata, generation, _ = open_model_with_deltas(self.model_path, use_mmap=False)
+        matcher = compact_gallery(matcher)
+        metadata.update({
+            'generation': generation,
+            'compacted_at': datetime.now().isoformat(),
+        })
+        
+        backup_path = f"{self.model_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        shutil.copy2(self.model_path, backup_path)
+        print(f"💾 Backup criado: {backup_path}")
+        
+        build_index_for_model(matcher, self.model_path)
+        write_model(self.model_path, matcher, metadata)
+        print(f"🗜️ Modelo compactado na geração {generation}: {len(matcher)} encodings")
+    
     def mark_feedback_processed(self, feedback_ids):
         """Marcar feedback como processado"""
         if not feedback_ids:
             return
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         placeholders = ','.join(['?'] * len(feedback_ids))
-        cursor.execute(f"""
+        self.db.execute(f"""
             UPDATE feedback 
             SET processed = TRUE 
             WHERE id IN ({placeholders})
         """, feedback_ids)
         
-        conn.commit()
-        conn.close()
-        
         print(f"✅ {len(feedback_ids)} feedbacks marcados como processados")
     
     def retrain_with_feedback(self):
-        """Executar processo completo de retreino com feedback"""
+        """Executar processo completo de retreino com feedback
+        
+        Levanta RetrainInProgressError se outro retreino estiver a decorrer.
+        """
+        with retrain_lock(self.model_path):
+            return self._retrain_with_feedback()
+    
+    def _retrain_with_feedback(self):
         print("🔄 Iniciando retreino com feedback...")
         
         # 1. Obter dados de feedback
+        self.report('feedback')
         feedback_data = self.get_feedback_data()
         
         if not feedback_data:
@@ -235,13 +398,15 @@ class RetainModel:
         print(f"✅ {len(corrections)} correções processadas")
         
         # 3. Atualizar encodings das pessoas
-        self.update_person_encodings(corrections)
+        changed_people = self.update_person_encodings(corrections)
         
-        # 4. Reconstruir modelo
-        success = self.rebuild_model()
+        # 4. Atualizar o modelo (só as pessoas alteradas)
+        self.report('rebuilding')
+        success = self.update_model(changed_people)
         
         if success:
             # 5. Marcar feedback como processado
+            self.report('finalizing')
             feedback_ids = [correction['feedback_id'] for correction in corrections]
             self.mark_feedback_processed(feedback_ids)
             
@@ -253,33 +418,21 @@ class RetainModel:
     
     def get_retrain_stats(self):
         """Obter estatísticas do retreino"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Feedback total
-        cursor.execute("SELECT COUNT(*) FROM feedback")
-        total_feedback = cursor.fetchone()[0]
-        
-        # Feedback processado
-        cursor.execute("SELECT COUNT(*) FROM feedback WHERE processed = TRUE")
-        processed_feedback = cursor.fetchone()[0]
-        
-        # Feedback pendente
-        cursor.execute("SELECT COUNT(*) FROM feedback WHERE processed = FALSE")
-        pending_feedback = cursor.fetchone()[0]
-        
-        # Últimas correções
-        cursor.execute("""
-            SELECT f.correct_prediction, f.created_at
-            FROM feedback f
-            WHERE f.processed = TRUE
-            ORDER BY f.created_at DESC
-            LIMIT 10
-        """)
-        
-        recent_corrections = cursor.fetchall()
-        
-        conn.close()
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            
+            total_feedback, processed_feedback, pending_feedback = feedback_counts(conn)
+            
+            # Últimas correções
+            cursor.execute("""
+                SELECT f.correct_prediction, f.created_at
+                FROM feedback f
+                WHERE f.processed = TRUE
+                ORDER BY f.created_at DESC
+                LIMIT 10
+            """)
+            
+            recent_corrections = cursor.fetchall()
         
         return {
             'total_feedback': total_feedback,
@@ -302,7 +455,11 @@ if __name__ == "__main__":
     
     if stats['pending_feedback'] > 0:
         print(f"\n🔄 Iniciando retreino com {stats['pending_feedback']} feedbacks pendentes...")
-        success = retrainer.retrain_with_feedback()
+        try:
+            success = retrainer.retrain_with_feedback()
+        except RetrainInProgressError as e:
+            print(f"⏳ {e}")
+            success = False
         
         if success:
             print("🎉 Retreino concluído com sucesso!")
@@ -0,0 +1,163 @@
+# tests/test_ha_integration.py - NotificationDispatcher contra um servidor HTTP local (stub do HA)
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_integration import HomeAssistantIntegration, NotificationDispatcher
+
+TTS_PATH = '/api/services/tts/speak'
+NOTIFY_PATH = '/api/services/notify/persistent_notification'
+
+
+class StubHomeAssistant:
+    """Servidor HTTP local que regista os pedidos e responde com os códigos em fila"""
+
+    def __init__(self):
+        self.requests = []
+        self.tts_statuses = []  # códigos para os próximos pedidos de TTS (depois: 200)
+        self.release = threading.Event()  # limpar para bloquear as respostas
+        self.release.set()
+        self.received = threading.Condition()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stub.received:
+                    stub.requests.append((self.path, self.headers.get('Authorization'), body))
+                    stub.received.notify_all()
+                    status = stub.tts_statuses.pop(0) if self.path == TTS_PATH and stub.tts_statuses else 200
+                stub.release.wait(5)
+                self.send_response(status)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def paths(self):
+        with self.received:
+            return [path for path, _, _ in self.requests]
+
+    def wait_for(self, count, timeout=5):
+        with self.received:
+            return self.received.wait_for(lambda: len(self.requests) >= count, timeout)
+
+    def close(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class NotificationDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubHomeAssistant()
+        self.ha = HomeAssistantIntegration(self.stub.url, 'token-de-teste', timeout=5)
+        self.dispatcher = None
+
+    def tearDown(self):
+        self.stub.release.set()
+        if self.dispatcher:
+            self.dispatcher.close()
+        self.stub.close()
+
+    def create_dispatcher(self, **kwargs):
+        options = dict(max_queue=10, max_retries=3, retry_backoff=0.01, coalesce_seconds=30)
+        options.update(kwargs)
+        self.dispatcher = NotificationDispatcher(self.ha, **options)
+        return self.dispatcher
+
+    def test_sends_tts_and_notification(self):
+        dispatcher = self.create_dispatcher()
+        self.assertTrue(dispatcher.submit_greeting("Bom dia, Ana!", "media_player.hub",
+                                                   title="Face Recognition", notification="Detectado: Ana"))
+        dispatcher.flush()
+
+        self.assertEqual(self.stub.paths(), [TTS_PATH, NOTIFY_PATH])
+        _, authorization, body = self.stub.requests[0]
+        self.assertEqual(authorization, 'Bearer token-de-teste')
+        self.assertEqual(body['message'], "Bom dia, Ana!")
+        self.assertEqual(body['media_player_entity_id'], "media_player.hub")
+        self.assertEqual(dispatcher.stats['sent'], 1)
+
+    def test_coalesces_repeated_greetings(self):
+        dispatcher = self.create_dispatcher()
+        self.assertTrue(dispatcher.submit_greeting("Bom dia, Ana!", "media_player.hub"))
+        self.assertFalse(dispatcher.submit_greeting("Bom dia, Ana!", "media_player.hub"))
+        # Outra mensagem ou outro destino não são coalescidos
+        self.assertTrue(dispatcher.submit_greeting("Bom dia, Bruno!", "media_player.hub"))
+        self.assertTrue(dispatcher.submit_greeting("Bom dia, Ana!", "media_player.sala"))
+        dispatcher.flush()
+
+        self.assertEqual(self.stub.paths(), [TTS_PATH] * 3)
+        self.assertEqual(dispatcher.stats['coalesced'], 1)
+        self.assertEqual(dispatcher.stats['sent'], 3)
+
+    def test_coalescing_window_expires(self):
+        dispatcher = self.create_dispatcher(coalesce_seconds=0.05)
+        self.assertTrue(dispatcher.submit_greeting("Bom dia, Ana!", "media_player.hub"))
+        time.sleep(0.1)
+        self.assertTrue(dispatcher.submit_greeting("Bom dia, Ana!", "media_player.hub"))
+        dispatcher.flush()
+        self.assertEqual(dispatcher.stats['sent'], 2)
+
+    def test_retries_with_exponential_backoff(self):
+        self.stub.tts_statuses = [500, 503]
+        dispatcher = self.create_dispatcher(retry_backoff=0.05)
+        start = time.monotonic()
+        dispatcher.submit_greeting("Boa tarde, Ana!", "media_player.hub")
+        dispatcher.flush()
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(self.stub.paths(), [TTS_PATH] * 3)
+        self.assertEqual(dispatcher.stats['retries'], 2)
+        self.assertEqual(dispatcher.stats['sent'], 1)
+        self.assertEqual(dispatcher.stats['failed'], 0)
+        # 0.05 + 0.10 segundos de espera entre as três tentativas
+        self.assertGreaterEqual(elapsed, 0.15)
+
+    def test_gives_up_after_max_retries(self):
+        self.stub.tts_statuses = [500] * 10
+        dispatcher = self.create_dispatcher(max_retries=2)
+        dispatcher.submit_greeting("Boa noite, Ana!", "media_player.hub", notification="Detectado: Ana")
+        dispatcher.flush()
+
+        # 1 tentativa + 2 repetições; sem TTS não há notificação
+        self.assertEqual(self.stub.paths(), [TTS_PATH] * 3)
+        self.assertEqual(dispatcher.stats['failed'], 1)
+        self.assertEqual(dispatcher.stats['sent'], 0)
+
+    def test_bounded_queue_drops_when_full(self):
+        self.stub.release.clear()  # o HA fica "pendurado" no primeiro pedido
+        dispatcher = self.create_dispatcher(max_queue=2)
+        self.assertTrue(dispatcher.submit_greeting("Olá, 1!", "media_player.hub"))
+        self.assertTrue(self.stub.wait_for(1))
+
+        # A thread está ocupada com o primeiro: a fila aceita mais dois e descarta o resto
+        start = time.monotonic()
+        accepted = [dispatcher.submit_greeting(f"Olá, {i}!", "media_player.hub") for i in range(2, 6)]
+        self.assertLess(time.monotonic() - start, 0.5)  # submit nunca bloqueia
+        self.assertEqual(accepted, [True, True, False, False])
+        self.assertEqual(dispatcher.stats['dropped'], 2)
+
+        self.stub.release.set()
+        dispatcher.flush()
+        self.assertEqual(dispatcher.stats['sent'], 3)
+        self.assertEqual([body['message'] for _, _, body in self.stub.requests],
+                         ["Olá, 1!", "Olá, 2!", "Olá, 3!"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+# thumbnails.py - Miniaturas recortadas à face, com cache em disco limitada (LRU)
+import hashlib
+import os
+import threading
+import time
+import cv2
+from config import config
+
+# Margem à volta da face (fração do tamanho da caixa) para a miniatura incluir contexto
+FACE_MARGIN = 0.5
+
+# Só atualizar o mtime (ordem LRU) de uma miniatura usada há mais tempo do que isto
+TOUCH_INTERVAL = 300
+
+FORMATS = {
+    'jpeg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+def parse_face_location(value):
+    """'top,right,bottom,left' (coluna face_location) -> tuplo de inteiros, ou None"""
+    if not value:
+        return None
+    try:
+        top, right, bottom, left = (int(v) for v in value.split(','))
+    except ValueError:
+        return None
+    return top, right, bottom, left
+
+
+def crop_region(box, margin=FACE_MARGIN):
+    """Região quadrada (top, right, bottom, left) à volta da face, com margem"""
+    top, right, bottom, left = box
+    side = max(bottom - top, right - left) * (1 + 2 * margin)
+    center_y, center_x = (top + bottom) / 2, (left + right) / 2
+    half = side / 2
+    return (int(center_y - half), int(center_x + half), int(center_y + half), int(center_x - half))
+
+
+class ThumbnailCache:
+    """Gerar miniaturas na primeira utilização e guardá-las numa pasta de cache
+
+    O nome do ficheiro é um hash do original (caminho, tamanho, mtime), da caixa
+    da face e das definições, por isso uma miniatura nunca fica desatualizada e
+    o hash serve de ETag. Quando a pasta excede o limite, as miniaturas usadas
+    há mais tempo (mtime) são removidas.
+    """
+
+    def __init__(self, cache_dir=None, size=None, image_format=None, quality=None, max_bytes=None):
+        self.cache_dir = os.path.abspath(cache_dir or config.THUMBNAIL_CACHE_PATH)
+        self.size = size or config.THUMBNAIL_SIZE
+        self.format = (image_format or config.THUMBNAIL_FORMAT).lower()
+        if self.format not in FORMATS:
+            raise ValueError(f"Formato de miniatura não suportado: {self.format}")
+        self.quality = quality or config.THUMBNAIL_QUALITY
+        self.max_bytes = config.THUMBNAIL_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+
+        self.extension, self.mimetype, self._quality_flag = FORMATS[self.format]
+        self._lock = threading.Lock()
+        self._total_bytes = None  # calculado na primeira escrita
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key_for(self, image_path, box=None):
+        """Chave da miniatura; None se o original não existir"""
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        source = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{box}|{self.size}|{self.format}|{self.quality}"
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + self.extension)
+
+    def get(self, image_path, box=None):
+        """(caminho da miniatura, chave) - gerada se ainda não existir; (None, None) se falhar"""
+        key = self.key_for(image_path, box)
+        if key is None:
+            return None, None
+
+        path = self.path_for(key)
+        try:
+            stat = os.stat(path)
+            self.hits += 1
+            if time.time() - stat.st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+            return path, key
+        except FileNotFoundError:
+            pass
+
+        self.misses += 1
+        data = self.render(image_path, box)
+        if data is None:
+            return None, None
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self._account(len(data))
+        return path, key
+
+    def render(self, image_path, box=None):
+        """Codificar a miniatura (recortada à face se houver caixa); bytes ou None"""
+        if box is None:
+            image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        else:
+            # As caixas foram calculadas sem aplicar a orientação EXIF
+            # (face_recognition lê com PIL), por isso aqui também não
+            crop = crop_region(box)
+            crop_side = min(crop[2] - crop[0], crop[1] - crop[3])
+
+            # Descodificar o JPEG já reduzido (2x/4x/8x) quando a região sobra
+            reduction, flags = 1, cv2.IMREAD_COLOR
+            for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                 (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if crop_side / factor >= self.size:
+                    reduction, flags = factor, flag
+                    break
+            image = cv2.imread(image_path, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+
+            if image is not None:
+                height, width = image.shape[:2]
+                top, right, bottom, left = (int(v / reduction) for v in crop)
+                top, left = max(0, top), max(0, left)
+                bottom, right = min(height, bottom), min(width, right)
+                if bottom > top and right > left:
+                    image = image[top:bottom, left:right]
+
+        if image is None:
+            return None
+
+        height, width = image.shape[:2]
+        factor = self.size / max(height, width)
+        if factor < 1.0:
+            image = cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+        ok, encoded = cv2.imencode(self.extension, image, [self._quality_flag, int(self.quality)])
+        return encoded.tobytes() if ok else None
+
+    def _scan(self):
+        """Miniaturas em cache: lista de (mtime, tamanho, caminho)"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.extension):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _account(self, added_bytes):
+        """Somar a nova miniatura ao total e remover as menos usadas se exceder o limite"""
+        if not self.max_bytes:
+            return
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._total_bytes += added_bytes
+
+            if self._total_bytes <= self.max_bytes:
+                return
+
+            # Remover até 90% do limite para não repetir a listagem a cada escrita
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+
+            self._total_bytes = total
+            if removed:
+                print(f"🧹 Cache de miniaturas: {removed} removidas ({total / 1e6:.1f} MB)")
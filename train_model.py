@@ -2,9 +2,117 @@
 import face_recognition
 import pickle
 import os
-import sqlite3
+import hashlib
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from config import config
+from database import get_database
+from face_matcher import FaceMatcher
+from face_index import build_index_for_model
+from gallery import compact_gallery
+from model_store import write_model, open_model, retrain_lock
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Parâmetros de deteção/encoding do treino (fazem parte da chave da cache)
+DETECTION_MODEL = "hog"
+DETECTION_UPSAMPLE = 1
+ENCODING_JITTERS = 1
+ENCODING_MODEL = "small"
+DETECTOR_SETTINGS = f"{DETECTION_MODEL}:up{DETECTION_UPSAMPLE}:jit{ENCODING_JITTERS}:{ENCODING_MODEL}"
+
+def encode_training_image(image_path):
+    """Carregar uma foto de treino e extrair o encoding da primeira face
+    
+    Função ao nível do módulo para poder correr nos processos do pool.
+    Devolve (encoding ou None, erro ou None, segundos gastos).
+    """
+    start = time.perf_counter()
+    try:
+        image = face_recognition.load_image_file(image_path)
+        face_locations = face_recognition.face_locations(
+            image, number_of_times_to_upsample=DETECTION_UPSAMPLE, model=DETECTION_MODEL
+        )
+        face_encodings = face_recognition.face_encodings(
+            image, face_locations, num_jitters=ENCODING_JITTERS, model=ENCODING_MODEL
+        )
+        encoding = face_encodings[0] if face_encodings else None
+        error = None
+    except Exception as e:
+        encoding, error = None, str(e)
+    return encoding, error, time.perf_counter() - start
+
+class EncodingCache:
+    """Cache em disco de encodings de treino, indexada pelo hash do conteúdo
+    
+    Guarda também (tamanho, mtime) por caminho para evitar re-ler ficheiros
+    inalterados. Toda a cache é invalidada se DETECTOR_SETTINGS mudar.
+    """
+    
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or config.TRAINING_CACHE_PATH
+        self.entries = {}  # hash -> encoding (ou None se não houver face)
+        self.files = {}    # caminho -> (tamanho, mtime_ns, hash)
+        self.hits = 0
+        self.misses = 0
+        self.load()
+    
+    def load(self):
+        """Carregar cache do disco (ignorada se as definições do detetor mudaram)"""
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('settings') == DETECTOR_SETTINGS:
+                self.entries = data['entries']
+                self.files = data['files']
+            else:
+                print("ℹ️ Definições do detetor mudaram - cache de treino invalidada")
+        except Exception as e:
+            print(f"⚠️ Erro ao carregar cache de treino: {e}")
+    
+    def save(self):
+        """Guardar cache (escrita atómica)"""
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'settings': DETECTOR_SETTINGS, 'entries': self.entries, 'files': self.files}, f)
+        os.replace(tmp_path, self.cache_path)
+    
+    def key_for(self, image_path):
+        """Hash do conteúdo do ficheiro (reaproveitado se tamanho e mtime não mudaram)"""
+        stat = os.stat(image_path)
+        known = self.files.get(image_path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        
+        with open(image_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self.files[image_path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+    
+    def __contains__(self, key):
+        return key in self.entries
+    
+    def get(self, key):
+        self.hits += 1
+        return self.entries[key]
+    
+    def put(self, key, encoding):
+        self.misses += 1
+        self.entries[key] = encoding
+    
+    def prune(self, image_paths):
+        """Remover entradas de ficheiros que já não existem na pasta de treino"""
+        image_paths = set(image_paths)
+        self.files = {path: info for path, info in self.files.items() if path in image_paths}
+        live_keys = {info[2] for info in self.files.values()}
+        removed = len(self.entries) - len(live_keys & self.entries.keys())
+        self.entries = {key: value for key, value in self.entries.items() if key in live_keys}
+        return removed
 
 class FaceTrainer:
     def __init__(self, db_path="face_recognition.db"):
@@ -12,45 +120,87 @@ class FaceTrainer:
         self.known_encodings = []
         self.known_names = []
     
-    def train_from_images(self, training_folder="training_images"):
-        """Treinar modelo com imagens da pasta training_images"""
+    def train_from_images(self, training_folder="training_images", workers=None, use_cache=True):
+        """Treinar modelo com imagens da pasta training_images
+        
+        Com workers > 1 o decode, deteção e encoding são distribuídos por um
+        pool de processos; os resultados chegam pela mesma ordem do modo
+        serial, pelo que o modelo produzido é idêntico. Com use_cache apenas
+        as fotos novas ou alteradas são processadas.
+        """
         if not os.path.exists(training_folder):
             print(f"❌ Pasta {training_folder} não existe!")
             return False
         
-        print("🎯 Iniciando treino do modelo...")
+        workers = workers or config.TRAINING_WORKERS or os.cpu_count()
+        print(f"🎯 Iniciando treino do modelo ({workers} worker(s))...")
         
         # Limpar dados anteriores
         self.known_encodings = []
         self.known_names = []
         
-        # Processar cada pessoa
+        # Recolher fotos de cada pessoa
+        people = []
         for person_folder in os.listdir(training_folder):
             person_path = os.path.join(training_folder, person_folder)
             if not os.path.isdir(person_path):
                 continue
-                
+            image_files = [f for f in os.listdir(person_path) if f.lower().endswith(IMAGE_EXTENSIONS)]
+            people.append((person_folder, person_path, image_files))
+        
+        all_image_paths = [os.path.join(person_path, f) for _, person_path, image_files in people for f in image_files]
+        
+        start_time = time.perf_counter()
+        total_image_time = 0.0
+        
+        # Consultar cache: só as fotos novas/alteradas vão para os workers, uma
+        # vez por conteúdo (fotos iguais em pastas diferentes são codificadas uma só vez)
+        cache = EncodingCache() if use_cache else None
+        cache_keys = {}
+        if cache:
+            cache_keys = {image_path: cache.key_for(image_path) for image_path in all_image_paths}
+            pending_by_key = {}
+            for image_path in all_image_paths:
+                if cache_keys[image_path] not in cache:
+                    pending_by_key.setdefault(cache_keys[image_path], image_path)
+            pending_paths = list(pending_by_key.values())
+        else:
+            pending_paths = all_image_paths
+        # Decidido antes de começar: o cache muda durante o ciclo
+        pending_set = set(pending_paths)
+        encoded = {}  # chave -> resultado das fotos codificadas nesta execução
+        results = self._encode_images(pending_paths, workers)
+        
+        # Processar cada pessoa
+        for person_folder, person_path, image_files in people:
             print(f"📸 Processando fotos de {person_folder}...")
             person_encodings = []
             
             # Processar cada foto da pessoa
-            for image_file in os.listdir(person_path):
-                if image_file.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
-                    image_path = os.path.join(person_path, image_file)
-                    
-                    try:
-                        # Carregar e processar imagem
-                        image = face_recognition.load_image_file(image_path)
-                        face_encodings = face_recognition.face_encodings(image)
-                        
-                        if face_encodings:
-                            person_encodings.append(face_encodings[0])
-                            print(f"  ✅ {image_file} - Face detectada")
-                        else:
-                            print(f"  ⚠️ {image_file} - Nenhuma face encontrada")
-                            
-                    except Exception as e:
-                        print(f"  ❌ {image_file} - Erro: {e}")
+            for image_file in image_files:
+                image_path = os.path.join(person_path, image_file)
+                key = cache_keys.get(image_path, image_path)
+                if image_path in pending_set:
+                    encoding, error, elapsed = next(results)
+                    total_image_time += elapsed
+                    encoded[key] = (encoding, error, 0.0)
+                    # Erros não são guardados (podem ser transitórios)
+                    if cache and not error:
+                        cache.put(key, encoding)
+                elif key in encoded:
+                    encoding, error, elapsed = encoded[key]
+                else:
+                    encoding, error, elapsed = cache.get(key), None, 0.0
+                
+                if error:
+                    print(f"  ❌ {image_file} - Erro: {error}")
+                elif encoding is not None:
+                    # Cópia com o dtype canónico: arrays vindos dos workers trazem a
+                    # sua própria instância de dtype e o pickle do modelo seria diferente
+                    person_encodings.append(encoding.astype(np.float64))
+                    print(f"  ✅ {image_file} - Face detectada ({elapsed:.2f}s)")
+                else:
+                    print(f"  ⚠️ {image_file} - Nenhuma face encontrada ({elapsed:.2f}s)")
             
             # Adicionar pessoa ao modelo se tiver encodings
             if person_encodings:
@@ -66,6 +216,18 @@ class FaceTrainer:
             else:
                 print(f"  ❌ {person_folder}: Nenhuma face válida encontrada")
         
+        results.close()
+        wall_time = time.perf_counter() - start_time
+        if pending_paths:
+            print(f"⏱️ {len(pending_paths)} imagens processadas em {wall_time:.1f}s "
+                  f"(média {total_image_time / len(pending_paths):.2f}s/imagem, "
+                  f"speedup {total_image_time / max(wall_time, 1e-9):.1f}x)")
+        
+        if cache:
+            removed = cache.prune(all_image_paths)
+            cache.save()
+            print(f"🗃️ Cache de treino: {cache.hits} reutilizados, {cache.misses} novos, {removed} removidos")
+        
         # Salvar modelo
         if self.known_encodings:
             self.save_model()
@@ -75,55 +237,83 @@ class FaceTrainer:
             print("❌ Nenhuma face foi processada com sucesso!")
             return False
     
+    def _encode_images(self, image_paths, workers):
+        """Gerador de (encoding, erro, tempo) pela ordem de image_paths"""
+        if workers <= 1 or len(image_paths) <= 1:
+            for image_path in image_paths:
+                yield encode_training_image(image_path)
+            return
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(encode_training_image, image_paths)
+    
     def save_person_to_db(self, name, encoding):
         """Salvar pessoa na base de dados"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Verificar se pessoa já existe
-        cursor.execute("SELECT id FROM people WHERE name = ?", (name,))
-        if cursor.fetchone():
-            # Atualizar encoding existente
-            cursor.execute(
-                "UPDATE people SET face_encoding = ?, updated_at = ? WHERE name = ?",
-                (pickle.dumps(encoding), datetime.now(), name)
-            )
-        else:
-            # Inserir nova pessoa
-            cursor.execute(
-                "INSERT INTO people (name, face_encoding) VALUES (?, ?)",
-                (name, pickle.dumps(encoding))
-            )
+        def upsert(cursor):
+            # Verificar se pessoa já existe
+            cursor.execute("SELECT id FROM people WHERE name = ?", (name,))
+            if cursor.fetchone():
+                # Atualizar encoding existente
+                cursor.execute(
+                    "UPDATE people SET face_encoding = ?, updated_at = ? WHERE name = ?",
+                    (pickle.dumps(encoding), datetime.now(), name)
+                )
+            else:
+                # Inserir nova pessoa
+                cursor.execute(
+                    "INSERT INTO people (name, face_encoding) VALUES (?, ?)",
+                    (name, pickle.dumps(encoding))
+                )
         
-        conn.commit()
-        conn.close()
+        get_database(self.db_path).transaction(upsert)
     
-    def save_model(self, model_path="models/face_model.pkl"):
-        """Salvar modelo treinado"""
-        os.makedirs("models", exist_ok=True)
+    def save_model(self, model_path=None):
+        """Salvar modelo treinado (formato binário, ver model_store.py)"""
+        model_path = model_path or config.MODEL_PATH
+        os.makedirs(os.path.dirname(model_path) or '.', exist_ok=True)
+        
+        matcher = FaceMatcher(self.known_encodings, self.known_names)
+        metadata = {'training_date': datetime.now().isoformat()}
         
-        model_data = {
-            'encodings': self.known_encodings,
-            'names': self.known_names,
-            'training_date': datetime.now().isoformat()
-        }
+        # Protótipos por pessoa (GALLERY_PROTOTYPES) em vez de todas as fotos
+        if config.GALLERY_PROTOTYPES > 0:
+            compacted = compact_gallery(matcher)
+            print(f"🗜️ Galeria compactada: {len(matcher)} -> {len(compacted)} encodings")
+            metadata.update({'prototypes': config.GALLERY_PROTOTYPES, 'source_encodings': len(matcher)})
+            matcher = compacted
         
-        with open(model_path, 'wb') as f:
-            pickle.dump(model_data, f)
+        # Substituir o modelo base apaga o log de gerações: esperar por um
+        # retreino em curso em vez de perder as gerações que ele anexar
+        with retrain_lock(model_path, wait=True):
+            # Índice ANN opcional (escrito antes do modelo: um leitor que veja o
+            # modelo novo encontra sempre o índice correspondente)
+            build_index_for_model(matcher, model_path)
+            
+            # Escrita atómica: leitores em execução nunca veem um modelo incompleto
+            write_model(model_path, matcher, metadata)
         
         print(f"💾 Modelo salvo em {model_path}")
     
-    def load_model(self, model_path="models/face_model.pkl"):
+    def load_model(self, model_path=None):
         """Carregar modelo treinado"""
+        model_path = model_path or config.MODEL_PATH
         if os.path.exists(model_path):
-            with open(model_path, 'rb') as f:
-                model_data = pickle.load(f)
-                self.known_encodings = model_data['encodings']
-                self.known_names = model_data['names']
+            matcher, _ = open_model(model_path, use_mmap=False)
+            self.known_encodings = list(matcher.encodings)
+            self.known_names = matcher.names
             print(f"📂 Modelo carregado: {len(self.known_encodings)} encodings")
             return True
         return False
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Treinar modelo de reconhecimento facial")
+    parser.add_argument('--folder', default="training_images", help="Pasta com uma subpasta por pessoa")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Processos de encoding (padrão: TRAINING_WORKERS; 1 = serial)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Ignorar a cache de encodings e processar todas as fotos")
+    args = parser.parse_args()
+    
     trainer = FaceTrainer()
-    trainer.train_from_images()
\ No newline at end of file
+    trainer.train_from_images(args.folder, workers=args.workers, use_cache=not args.no_cache)
\ No newline at end of file
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# video_stream.py - Reconhecimento em vídeo/RTSP: amostragem de frames, deteção num pool e tracking
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+import cv2
+import face_recognition
+from config import config
+from face_recognizer import downscale_for_detection, scale_face_location
+from face_tracker import IoUTracker
+from motion import MotionGate, detection_area
+
+# Margem à volta da face (fração do tamanho da caixa) no recorte enviado para encoding
+ENCODING_MARGIN = 0.5
+
+# Tentativas de encoding por face seguida (uma por frame amostrado) antes de desistir
+MAX_ENCODING_ATTEMPTS = 3
+
+
+def is_live_source(source):
+    """URL (rtsp://, http://) ou índice de câmara; ficheiros de vídeo não são ao vivo"""
+    return '://' in source or source.isdigit()
+
+
+def stream_source_name(source):
+    """Nome da fonte guardado na coluna source das detecções (ex.: stream:porta.mp4)"""
+    if source.isdigit():
+        name = f"camera{source}"
+    elif '://' in source:
+        url = urlparse(source)
+        name = (url.hostname or '') + url.path
+    else:
+        name = os.path.basename(source)
+    return "stream:" + re.sub(r'[^\w.\-/]', '_', name).strip('/')
+
+
+def open_capture(source):
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        capture.release()
+        return None
+    return capture
+
+
+def _detect_in_worker(small_rgb):
+    """Deteção HOG num processo do pool (imagem já reduzida)"""
+    return face_recognition.face_locations(small_rgb, model="hog")
+
+
+def _encode_in_worker(crops):
+    """Encodings das faces por reconhecer: lista de (recorte RGB, caixa no recorte)
+
+    Devolve (encoding ou None, erro ou None) por recorte - um recorte com
+    erro não faz perder os restantes.
+    """
+    results = []
+    for crop, box in crops:
+        try:
+            results.append((face_recognition.face_encodings(crop, [box])[0], None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+def crop_for_encoding(frame, box, margin=ENCODING_MARGIN):
+    """Recorte RGB à volta da face e a caixa nas coordenadas do recorte"""
+    top, right, bottom, left = box
+    pad = int(max(bottom - top, right - left) * margin)
+    height, width = frame.shape[:2]
+    y0, x0 = max(0, top - pad), max(0, left - pad)
+    y1, x1 = min(height, bottom + pad), min(width, right + pad)
+    crop = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+    return crop, (top - y0, right - x0, bottom - y0, left - x0)
+
+
+class StreamProcessor:
+    """Ler frames de um vídeo ou câmara e reconhecer cada face uma só vez
+
+    Os frames são amostrados (STREAM_SAMPLE_INTERVAL sem faces à vista,
+    STREAM_ACTIVE_INTERVAL enquanto há faces seguidas) e os restantes são
+    saltados sem descodificar. A deteção corre num pool de processos; o
+    IoUTracker associa as caixas às faces já vistas e só as faces ainda não
+    reconhecidas são codificadas e comparadas com o modelo (um encoding que
+    falhe é repetido no frame amostrado seguinte, até MAX_ENCODING_ATTEMPTS
+    vezes). on_event(frame, faces, timestamp) é chamado uma vez por frame
+    com faces novas reconhecidas.
+
+    Só a área de deteção configurada para a fonte (detection_areas.py) é
+    analisada. Com MOTION_ENABLED os frames amostrados passam primeiro pelo
+    MotionGate: frames sem movimento nessa área não vão ao detetor (as faces
+    seguidas mantêm-se) e, havendo movimento, só a parte à volta das regiões
+    em movimento é analisada.
+
+    Ficheiros de vídeo são processados o mais depressa possível, com o tempo
+    do próprio vídeo e sem perder frames amostrados; em fontes ao vivo, se o
+    pool estiver ocupado, o frame é descartado em vez de acumular atraso.
+    Vários StreamProcessor podem partilhar o mesmo pool (run(executor)).
+    """
+
+    def __init__(self, recognizer, source, on_event, workers=None):
+        self.recognizer = recognizer
+        self.source = source
+        self.source_name = stream_source_name(source)
+        self.on_event = on_event
+        self.live = is_live_source(source)
+        self.workers = workers or config.STREAM_WORKERS or os.cpu_count()
+        self.max_pending = config.STREAM_MAX_PENDING or 2 * self.workers
+        self.tracker = IoUTracker(config.STREAM_IOU_THRESHOLD, config.STREAM_TRACK_TTL)
+        self.motion = MotionGate() if config.MOTION_ENABLED else None
+        self._stop = threading.Event()
+
+        self.stats = {
+            'frames': 0,
+            'sampled': 0,
+            'dropped': 0,
+            'still': 0,
+            'cropped': 0,
+            'faces': 0,
+            'tracks': 0,
+            'encoded': 0,
+            'encode_errors': 0,
+            'events': 0,
+        }
+
+    def _timestamp(self, capture):
+        if self.live:
+            return time.monotonic()
+        return capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+    def _interval(self):
+        return config.STREAM_ACTIVE_INTERVAL if len(self.tracker) else config.STREAM_SAMPLE_INTERVAL
+
+    def stop(self):
+        """Pedir para terminar (ex.: a partir de outra thread)"""
+        self._stop.set()
+
+    def run(self, executor=None):
+        """Processar a fonte até ao fim do ficheiro, stop() ou Ctrl+C"""
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                return self.run(executor)
+
+        capture = open_capture(self.source)
+        if capture is None:
+            print(f"❌ Não foi possível abrir: {self.source}")
+            return self.stats
+
+        print(f"🎥 Stream {self.source}: {self.workers} worker(s), "
+              f"amostragem {config.STREAM_SAMPLE_INTERVAL}s/{config.STREAM_ACTIVE_INTERVAL}s, "
+              f"movimento: {self.motion.method if self.motion else 'desligado'}")
+
+        detecting = deque()  # (timestamp, frame, fator, área analisada, future) por ordem de chegada
+        encoding = deque()   # (timestamp, frame, tracks, future)
+        last_sample = None
+        start = time.perf_counter()
+
+        try:
+            while not self._stop.is_set():
+                if not capture.grab():
+                    if not self.live:
+                        break
+                    capture = self._reconnect(capture)
+                    if capture is None:
+                        break
+                    continue
+                self.stats['frames'] += 1
+
+                timestamp = self._timestamp(capture)
+                if last_sample is not None and timestamp - last_sample < self._interval():
+                    self._collect(executor, detecting, encoding)
+                    continue
+
+                if self.live and len(detecting) + len(encoding) >= self.max_pending:
+                    self.stats['dropped'] += 1
+                    self._collect(executor, detecting, encoding)
+                    continue
+
+                ok, frame = capture.retrieve()
+                if not ok:
+                    continue
+                last_sample = timestamp
+                self.stats['sampled'] += 1
+
+                # Área de deteção configurada para a fonte (ou o frame inteiro)
+                full_frame = (0, frame.shape[1], frame.shape[0], 0)
+                area = self.recognizer.detection_area_for(self.source_name, frame.shape) or full_frame
+
+                # Sem movimento (dentro da área): a cena não mudou, as faces seguidas continuam lá.
+                # O MotionGate só vê a área, por isso movimento fora dela não conta
+                if self.motion:
+                    top, right, bottom, left = area
+                    regions = self.motion.check(frame[top:bottom, left:right])
+                    if not regions:
+                        self.stats['still'] += 1
+                        self.tracker.keep_alive(timestamp)
+                        self._collect(executor, detecting, encoding)
+                        continue
+                    moving = detection_area(regions, (bottom - top, right - left))
+                    area = (moving[0] + top, moving[1] + left, moving[2] + top, moving[3] + left)
+                if area != full_frame:
+                    self.stats['cropped'] += 1
+
+                top, right, bottom, left = area
+                small, factor = downscale_for_detection(frame[top:bottom, left:right])
+                small_rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+                detecting.append((timestamp, frame, factor, area,
+                                  executor.submit(_detect_in_worker, small_rgb)))
+
+                # Ficheiros: esperar em vez de descartar
+                self._collect(executor, detecting, encoding,
+                              block=not self.live and len(detecting) + len(encoding) >= self.max_pending)
+
+            self._collect(executor, detecting, encoding, drain=True)
+
+        except KeyboardInterrupt:
+            print("\n👋 Stream terminado")
+        finally:
+            capture.release()
+
+        elapsed = time.perf_counter() - start
+        self.stats['seconds'] = round(elapsed, 1)
+        print(f"📊 Stream {self.source}: {self.stats['frames']} frames, {self.stats['sampled']} amostrados, "
+              f"{self.stats['dropped']} descartados, {self.stats['still']} sem movimento, "
+              f"{self.stats['cropped']} recortados, {self.stats['faces']} faces em {self.stats['tracks']} tracks, "
+              f"{self.stats['encoded']} encodings, {self.stats['events']} eventos "
+              f"({self.stats['frames'] / max(elapsed, 1e-9):.0f} frames/s)")
+        return self.stats
+
+    def _reconnect(self, capture):
+        """Fonte ao vivo sem frames: reabrir após STREAM_RECONNECT_DELAY segundos (None se parado)"""
+        capture.release()
+        while True:
+            print(f"⚠️ Stream sem frames, a reconectar em {config.STREAM_RECONNECT_DELAY}s: {self.source}")
+            if self._stop.wait(config.STREAM_RECONNECT_DELAY):
+                return None
+            capture = open_capture(self.source)
+            if capture is not None:
+                print(f"✅ Stream reconectado: {self.source}")
+                return capture
+
+    def _collect(self, executor, detecting, encoding, block=False, drain=False):
+        """Tratar resultados prontos, sempre pela ordem dos frames"""
+        while detecting and (drain or block or detecting[0][-1].done()):
+            timestamp, frame, factor, (top, right, bottom, left), future = detecting.popleft()
+            block = False
+            try:
+                locations = future.result()
+            except Exception as e:
+                print(f"❌ Erro na deteção: {e}")
+                continue
+
+            # Caixas na área analisada -> frame completo
+            area_shape = (bottom - top, right - left)
+            boxes = []
+            for location in locations:
+                box_top, box_right, box_bottom, box_left = scale_face_location(location, factor, area_shape)
+                boxes.append((int(box_top + top), int(box_right + left), int(box_bottom + top), int(box_left + left)))
+            self.stats['faces'] += len(boxes)
+            assigned, new_tracks, _ = self.tracker.update(boxes, timestamp)
+            self.stats['tracks'] += len(new_tracks)
+
+            # Faces novas e as que ainda não foram reconhecidas (encoding falhado)
+            tracks = [track for track in assigned
+                      if not track.identified and not track.encoding and track.attempts < MAX_ENCODING_ATTEMPTS]
+            if not tracks:
+                continue
+            for track in tracks:
+                track.encoding = True
+            crops = [crop_for_encoding(frame, track.box) for track in tracks]
+            encoding.append((timestamp, frame, tracks, executor.submit(_encode_in_worker, crops)))
+
+        while encoding and (drain or encoding[0][-1].done()):
+            timestamp, frame, tracks, future = encoding.popleft()
+            for track in tracks:
+                track.encoding = False
+            try:
+                results = future.result()
+            except Exception as e:
+                # Falha do worker: as faces voltam a ser tentadas no próximo frame amostrado
+                results = [(None, str(e))] * len(tracks)
+
+            encoded = []
+            for track, (face_encoding, error) in zip(tracks, results):
+                if face_encoding is None:
+                    track.attempts += 1
+                    self.stats['encode_errors'] += 1
+                    print(f"❌ Erro no encoding (face {track.id}, tentativa {track.attempts}): {error}")
+                else:
+                    encoded.append((track, face_encoding))
+            if not encoded:
+                continue
+
+            self.stats['encoded'] += len(encoded)
+            self.recognizer.reload_if_changed()
+            faces = self.recognizer.match_faces([track.box for track, _ in encoded],
+                                                [face_encoding for _, face_encoding in encoded])
+            for (track, _), face in zip(encoded, faces):
+                track.face = face
+            if faces:
+                self.stats['events'] += 1
+                self.on_event(frame, faces, timestamp)
+
+
+if __name__ == "__main__":
+    import sys
+    from face_recognizer import FaceRecognizer
+
+    if len(sys.argv) < 2:
+        print("Uso: python video_stream.py <vídeo|rtsp://...|índice da câmara> [workers]")
+        sys.exit(1)
+
+    def print_event(frame, faces, timestamp):
+        names = ', '.join(f"{face['name']} ({face['confidence']:.2f})" for face in faces)
+        print(f"👤 {timestamp:8.2f}s: {names}")
+
+    processor = StreamProcessor(FaceRecognizer(), sys.argv[1], print_event,
+                                workers=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    processor.run()
@@ -1,41 +1,102 @@
 #!/usr/bin/env python3
 # web_validation.py
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_from_directory
-import sqlite3
+from flask import Flask, render_template, request, jsonify, redirect, url_for, send_from_directory, send_file, abort, Response
 import os
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 from config import config
+from database import get_database, detection_counts, feedback_counts
 from werkzeug.utils import secure_filename
 import uuid
 from face_recognizer import FaceRecognizer
+from thumbnails import ThumbnailCache, parse_face_location
+from retrain_jobs import RetrainJobManager
 
 app = Flask(__name__)
 
+# Tamanho máximo de uma página da fila de validação
+MAX_PAGE_SIZE = 200
+
+# Validação em massa: decisões por pedido e IDs por consulta IN (...)
+MAX_BULK_DECISIONS = 1000
+BULK_CHUNK_SIZE = 500
+
+# Intervalo entre comentários keep-alive no stream de progresso do retreino
+SSE_KEEPALIVE_SECONDS = 15
+
+def encode_cursor(timestamp, detection_id):
+    """Cursor opaco com a chave (timestamp, id) da última detecção de uma página"""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, detection_id]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Inverso de encode_cursor; ValueError se o cursor for inválido"""
+    try:
+        timestamp, detection_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(timestamp), int(detection_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
 class ValidationApp:
     def __init__(self, db_path=None, images_base_path=None):
         self.db_path = db_path or config.DB_PATH
+        self.db = get_database(self.db_path)
         self.images_base_path = images_base_path or config.IMAGES_BASE_PATH
     
     def get_pending_detections(self, limit=None):
         """Obter detecções pendentes de validação"""
+        detections, _ = self.get_pending_page(limit)
+        return detections
+    
+    def get_pending_page(self, limit=None, cursor=None, source=None, min_confidence=None,
+                         max_confidence=None, date_from=None, date_to=None):
+        """Página de detecções pendentes com paginação por cursor (keyset)
+        
+        A ordem é (timestamp, id) descendente; o cursor é a chave da última
+        detecção devolvida, por isso cada página é uma leitura do índice parcial
+        idx_detections_pending_keyset a partir desse ponto, sem OFFSET.
+        Devolve (detecções, próximo cursor ou None).
+        """
         limit = limit or config.MAX_DETECTIONS_LIMIT
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         
-        cursor.execute("""
+        conditions = ["d.is_verified = FALSE"]
+        params = []
+        if cursor:
+            last_timestamp, last_id = decode_cursor(cursor)
+            conditions.append("(d.timestamp, d.id) < (?, ?)")
+            params.extend([last_timestamp, last_id])
+        if source:
+            conditions.append("d.source = ?")
+            params.append(source)
+        if min_confidence is not None:
+            conditions.append("d.confidence_score >= ?")
+            params.append(min_confidence)
+        if max_confidence is not None:
+            conditions.append("d.confidence_score <= ?")
+            params.append(max_confidence)
+        # Datas comparadas como 'AAAA-MM-DD' para servir os dois formatos de
+        # timestamp na tabela ('AAAA-MM-DD HH:MM:SS' e isoformat com 'T')
+        if date_from:
+            conditions.append("d.timestamp >= ?")
+            params.append(date_from.isoformat())
+        if date_to:
+            # Dia inclusivo: tudo antes do início do dia seguinte
+            conditions.append("d.timestamp < ?")
+            params.append((date_to + timedelta(days=1)).isoformat())
+        
+        # Pedir uma linha a mais para saber se existe página seguinte
+        rows = self.db.fetchall(f"""
             SELECT d.id, d.image_path, d.detected_name, d.confidence_score, 
-                   d.timestamp, d.is_verified, p.name as actual_name
+                   d.timestamp, d.is_verified, p.name as actual_name, d.source
             FROM detections d
             LEFT JOIN people p ON d.correct_person_id = p.id
-            WHERE d.is_verified = FALSE
-            ORDER BY d.timestamp DESC
+            WHERE {' AND '.join(conditions)}
+            ORDER BY d.timestamp DESC, d.id DESC
             LIMIT ?
-        """, (limit,))
+        """, params + [limit + 1])
         
         detections = []
-        for row in cursor.fetchall():
+        for row in rows[:limit]:
             detections.append({
                 'id': row[0],
                 'image_path': row[1],
@@ -43,93 +104,120 @@ class ValidationApp:
                 'confidence_score': row[3],
                 'timestamp': row[4],
                 'is_verified': row[5],
-                'actual_name': row[6]
+                'actual_name': row[6],
+                'source': row[7]
             })
         
-        conn.close()
-        return detections
+        next_cursor = None
+        if len(rows) > limit:
+            last = detections[-1]
+            next_cursor = encode_cursor(last['timestamp'], last['id'])
+        
+        return detections, next_cursor
     
     def get_all_people(self):
         """Obter lista de todas as pessoas conhecidas"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id, name FROM people ORDER BY name")
-        people = [{'id': row[0], 'name': row[1]} for row in cursor.fetchall()]
-        
-        conn.close()
-        return people
+        rows = self.db.fetchall("SELECT id, name FROM people ORDER BY name")
+        return [{'id': row[0], 'name': row[1]} for row in rows]
+    
+    def get_pending_sources(self):
+        """Fontes com detecções pendentes (file, mobile_capture, stream:<nome>, ...)"""
+        rows = self.db.fetchall("""
+            SELECT DISTINCT source FROM detections
+            WHERE is_verified = FALSE AND source IS NOT NULL
+            ORDER BY source
+        """)
+        return [row[0] for row in rows]
     
     def validate_detection(self, detection_id, is_correct, correct_person_id=None, feedback_text=""):
         """Validar uma detecção"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.validate_detections([(detection_id, is_correct, correct_person_id)])
+        return True
+    
+    def validate_detections(self, decisions):
+        """Validar várias detecções numa única transação
         
-        # Atualizar detecção
-        cursor.execute("""
-            UPDATE detections 
-            SET is_verified = TRUE, correct_person_id = ?
-            WHERE id = ?
-        """, (correct_person_id, detection_id))
+        decisions: lista de (detection_id, is_correct, correct_person_id).
+        Uma confirmação sem pessoa indicada fica com a pessoa detectada como
+        correta; uma correção regista feedback para o retreino. is_correct
+        tem de ser um booleano (ValueError caso contrário): um valor em falta
+        não pode passar por correção. Devolve o número de detecções validadas.
+        """
+        for _, is_correct, _ in decisions:
+            if not isinstance(is_correct, bool):
+                raise ValueError("is_correct tem de ser true ou false")
+        decisions = [(int(detection_id), bool(is_correct), int(person_id) if person_id else None)
+                     for detection_id, is_correct, person_id in decisions]
+        if not decisions:
+            return 0
         
-        # Obter detecção original
-        cursor.execute("""
-            SELECT detected_name, detected_person_id FROM detections WHERE id = ?
-        """, (detection_id,))
+        def select_in(cursor, sql, values):
+            """SELECT ... IN (...) por blocos (limite de parâmetros do SQLite)"""
+            rows = []
+            for start in range(0, len(values), BULK_CHUNK_SIZE):
+                chunk = values[start:start + BULK_CHUNK_SIZE]
+                cursor.execute(sql.format(','.join(['?'] * len(chunk))), chunk)
+                rows.extend(cursor.fetchall())
+            return rows
         
-        detection = cursor.fetchone()
-        if detection:
-            original_name = detection[0]
-            
-            # Determinar nome correto
-            if correct_person_id:
-                cursor.execute("SELECT name FROM people WHERE id = ?", (correct_person_id,))
-                correct_name_row = cursor.fetchone()
-                correct_name = correct_name_row[0] if correct_name_row else "Desconhecido"
-            else:
-                correct_name = "Desconhecido"
+        def validate(cursor):
+            # Detecções originais e nomes das pessoas corretas, numa consulta cada
+            originals = {row[0]: row[1:] for row in select_in(
+                cursor, "SELECT id, detected_name, detected_person_id FROM detections WHERE id IN ({})",
+                sorted({d[0] for d in decisions}))}
+            names = dict(select_in(
+                cursor, "SELECT id, name FROM people WHERE id IN ({})",
+                sorted({d[2] for d in decisions if d[2]})))
             
-            # Registrar feedback se houve correção
-            if not is_correct:
+            updates = []
+            feedback = []
+            for detection_id, is_correct, correct_person_id in decisions:
+                if detection_id not in originals:
+                    continue
+                original_name, detected_person_id = originals[detection_id]
+                
+                if is_correct:
+                    updates.append((correct_person_id or detected_person_id, detection_id))
+                    continue
+                
+                # Registrar feedback da correção
+                updates.append((correct_person_id, detection_id))
+                correct_name = names.get(correct_person_id, "Desconhecido")
                 feedback_type = "correction" if correct_person_id else "unknown"
-                cursor.execute("""
-                    INSERT INTO feedback (detection_id, original_prediction, correct_prediction, 
-                                        feedback_type, processed)
-                    VALUES (?, ?, ?, ?, FALSE)
-                """, (detection_id, original_name, correct_name, feedback_type))
-        
-        conn.commit()
-        conn.close()
+                feedback.append((detection_id, original_name, correct_name, feedback_type))
+            
+            cursor.executemany("""
+                UPDATE detections 
+                SET is_verified = TRUE, correct_person_id = ?
+                WHERE id = ?
+            """, updates)
+            cursor.executemany("""
+                INSERT INTO feedback (detection_id, original_prediction, correct_prediction, 
+                                    feedback_type, processed)
+                VALUES (?, ?, ?, ?, FALSE)
+            """, feedback)
+            return len(updates)
         
-        return True
+        return self.db.transaction(validate)
+    
+    def confirm_pending_above(self, min_confidence, source=None):
+        """Confirmar de uma vez todas as detecções pendentes de pessoas conhecidas acima do limiar"""
+        sql = """
+            UPDATE detections 
+            SET is_verified = TRUE, correct_person_id = detected_person_id
+            WHERE is_verified = FALSE AND detected_person_id IS NOT NULL AND confidence_score >= ?
+        """
+        params = [min_confidence]
+        if source:
+            sql += " AND source = ?"
+            params.append(source)
+        return self.db.transaction(lambda cursor: cursor.execute(sql, params).rowcount)
     
     def get_detection_stats(self):
         """Obter estatísticas das detecções"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Total de detecções
-        cursor.execute("SELECT COUNT(*) FROM detections")
-        total = cursor.fetchone()[0]
-        
-        # Detecções verificadas
-        cursor.execute("SELECT COUNT(*) FROM detections WHERE is_verified = TRUE")
-        verified = cursor.fetchone()[0]
-        
-        # Detecções corretas
-        cursor.execute("""
-            SELECT COUNT(*) FROM detections 
-            WHERE is_verified = TRUE 
-            AND (detected_person_id = correct_person_id OR 
-                 (detected_person_id IS NULL AND correct_person_id IS NULL))
-        """)
-        correct = cursor.fetchone()[0]
-        
-        # Feedback pendente
-        cursor.execute("SELECT COUNT(*) FROM feedback WHERE processed = FALSE")
-        pending_feedback = cursor.fetchone()[0]
-        
-        conn.close()
+        with self.db.connection() as conn:
+            total, verified, correct = detection_counts(conn)
+            pending_feedback = feedback_counts(conn)[2]
         
         return {
             'total': total,
@@ -142,6 +230,21 @@ class ValidationApp:
 
 validation_app = ValidationApp()
 
+# Reconhecedor partilhado: o modelo é carregado uma vez e recarregado
+# apenas quando o ficheiro do modelo muda (ex.: após retreino)
+recognizer = FaceRecognizer()
+
+# Miniaturas da página de validação (geradas no primeiro pedido)
+thumbnails = ThumbnailCache()
+
+def create_retrainer(progress):
+    from retrain_model import RetainModel
+    return RetainModel(progress=progress)
+
+# Retreinos correm numa thread própria, um de cada vez; no fim o reconhecedor
+# partilhado recarrega o novo modelo
+retrain_jobs = RetrainJobManager(create_retrainer, on_success=recognizer.reload_if_changed)
+
 @app.route('/')
 def index():
     """Página principal com instruções e navegação"""
@@ -149,15 +252,43 @@ def index():
 
 @app.route('/validation')
 def validation():
-    """Página de validação com lista de detecções pendentes"""
-    detections = validation_app.get_pending_detections()
+    """Página de validação (as detecções pendentes são carregadas por /api/detections/pending)"""
     people = validation_app.get_all_people()
     stats = validation_app.get_detection_stats()
     
     return render_template('validation.html', 
-                         detections=detections, 
                          people=people, 
-                         stats=stats)
+                         stats=stats,
+                         sources=validation_app.get_pending_sources(),
+                         page_size=config.MAX_DETECTIONS_LIMIT)
+
+@app.route('/api/detections/pending')
+def pending_detections():
+    """API: página de detecções pendentes (paginação por cursor)
+    
+    Parâmetros: limit, cursor (next_cursor da página anterior), source,
+    min_confidence, max_confidence, from e to (AAAA-MM-DD, inclusivos).
+    """
+    args = request.args
+    try:
+        limit = min(max(int(args.get('limit', config.MAX_DETECTIONS_LIMIT)), 1), MAX_PAGE_SIZE)
+        min_confidence = float(args['min_confidence']) if args.get('min_confidence') else None
+        max_confidence = float(args['max_confidence']) if args.get('max_confidence') else None
+        date_from = datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from') else None
+        date_to = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') else None
+        
+        detections, next_cursor = validation_app.get_pending_page(
+            limit, cursor=args.get('cursor'), source=args.get('source') or None,
+            min_confidence=min_confidence, max_confidence=max_confidence,
+            date_from=date_from, date_to=date_to)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Parâmetros inválidos: {e}'}), 400
+    
+    return jsonify({
+        'success': True,
+        'detections': detections,
+        'next_cursor': next_cursor
+    })
 
 @app.route('/api/validate', methods=['POST'])
 def validate_detection():
@@ -174,14 +305,81 @@ def validate_detection():
     try:
         validation_app.validate_detection(detection_id, is_correct, correct_person_id, feedback_text)
         return jsonify({'success': True, 'message': 'Validação registrada com sucesso'})
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Pedido inválido: {e}'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/validate/bulk', methods=['POST'])
+def validate_detections_bulk():
+    """API para validar muitas detecções num único pedido e transação
+    
+    Aceita uma de três formas:
+      {"decisions": [{"detection_id": 1, "is_correct": true, "correct_person_id": null}, ...]}
+      {"detection_ids": [1, 2, 3], "is_correct": false, "correct_person_id": 7}
+      {"confirm_above": 0.8, "source": "file"}  (todas as pendentes acima do limiar)
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Pedido inválido: esperado um objeto JSON'}), 400
+    
+    try:
+        if data.get('confirm_above') is not None:
+            min_confidence = float(data['confirm_above'])
+            validated = validation_app.confirm_pending_above(min_confidence, data.get('source') or None)
+            return jsonify({'success': True, 'validated': validated,
+                            'message': f'{validated} detecções confirmadas'})
+        
+        if 'decisions' in data:
+            decisions = [(d['detection_id'], d.get('is_correct'), d.get('correct_person_id'))
+                         for d in data['decisions']]
+        else:
+            decisions = [(detection_id, data.get('is_correct'), data.get('correct_person_id'))
+                         for detection_id in data.get('detection_ids', [])]
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'Pedido inválido: {e}'}), 400
+    
+    if not decisions:
+        return jsonify({'success': False, 'error': 'Nenhuma detecção indicada'}), 400
+    if len(decisions) > MAX_BULK_DECISIONS:
+        return jsonify({'success': False, 'error': f'Máximo de {MAX_BULK_DECISIONS} detecções por pedido'}), 400
+    
+    try:
+        validated = validation_app.validate_detections(decisions)
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'Pedido inválido: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    return jsonify({'success': True, 'validated': validated,
+                    'message': f'{validated} detecções validadas'})
+
 @app.route('/images/<path:filename>')
 def serve_image(filename):
     """Servir imagens"""
     return send_from_directory(validation_app.images_base_path, filename)
 
+@app.route('/thumbnails/<int:detection_id>')
+def serve_thumbnail(detection_id):
+    """Servir miniatura da detecção, recortada à face quando a caixa é conhecida"""
+    row = validation_app.db.fetchone(
+        "SELECT image_path, face_location FROM detections WHERE id = ?", (detection_id,))
+    if not row:
+        abort(404)
+    
+    image_path, face_location = row
+    if not os.path.isabs(image_path):
+        image_path = os.path.join(validation_app.images_base_path, image_path)
+    
+    path, key = thumbnails.get(image_path, parse_face_location(face_location))
+    if path is None:
+        abort(404)
+    
+    # A chave muda com o original e com as definições, por isso serve de ETag;
+    # o browser revalida com If-None-Match e recebe 304 sem corpo
+    return send_file(path, mimetype=thumbnails.mimetype, etag=key,
+                     conditional=True, max_age=config.THUMBNAIL_MAX_AGE)
+
 @app.route('/stats')
 def stats():
     """Statistics page"""
@@ -194,38 +392,61 @@ def retrain():
     from retrain_model import RetainModel
     retrainer = RetainModel()
     retrain_stats = retrainer.get_retrain_stats()
-    return render_template('retrain.html', retrain_stats=retrain_stats)
+    return render_template('retrain.html', retrain_stats=retrain_stats,
+                           current_job=retrain_jobs.latest())
 
 @app.route('/api/retrain', methods=['POST'])
 def trigger_retrain():
-    """API para disparar retreino do modelo"""
-    import time
-    start_time = time.time()
+    """API para disparar retreino do modelo em segundo plano
     
-    try:
-        from retrain_model import RetainModel
-        retrainer = RetainModel()
-        success = retrainer.retrain_with_feedback()
-        
-        end_time = time.time()
-        duration = end_time - start_time
-        
-        if duration < 60:
-            training_time = f"{duration:.1f} segundos"
-        else:
-            training_time = f"{duration / 60:.1f} minutos"
-        
-        if success:
-            return jsonify({
-                'success': True, 
-                'message': 'Modelo retreinado com sucesso',
-                'training_time': training_time,
-                'duration_seconds': round(duration, 1)
-            })
-        else:
-            return jsonify({'error': 'Falha no retreino do modelo'}), 500
-    except Exception as e:
-        return jsonify({'error': f'Erro no retreino: {str(e)}'}), 500
+    Devolve 202 com o job_id; o progresso é consultado em
+    /api/retrain/jobs/<job_id> ou acompanhado em .../events (SSE).
+    """
+    job, created = retrain_jobs.submit()
+    state = job.to_dict()
+    state.update({
+        'status_url': url_for('retrain_job_status', job_id=job.id),
+        'events_url': url_for('retrain_job_events', job_id=job.id),
+    })
+    
+    if not created:
+        state.update({'success': False, 'error': 'Já existe um retreino a decorrer'})
+        return jsonify(state), 409
+    
+    state['success'] = True
+    return jsonify(state), 202
+
+@app.route('/api/retrain/jobs/<job_id>')
+def retrain_job_status(job_id):
+    """API: estado atual de um retreino"""
+    state = retrain_jobs.get(job_id)
+    if state is None:
+        return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+    return jsonify(state)
+
+@app.route('/api/retrain/jobs/<job_id>/events')
+def retrain_job_events(job_id):
+    """API: progresso do retreino como server-sent events (termina quando o job acaba)"""
+    if retrain_jobs.get(job_id) is None:
+        return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+    
+    def stream():
+        version = None
+        while True:
+            state = retrain_jobs.wait_for_change(job_id, version, timeout=SSE_KEEPALIVE_SECONDS)
+            if state is None:
+                return
+            if state['version'] == version:
+                # Comentário SSE para manter a ligação aberta através de proxies
+                yield ": keep-alive\n\n"
+                continue
+            version = state['version']
+            yield f"data: {json.dumps(state)}\n\n"
+            if state['status'] in ('succeeded', 'failed'):
+                return
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/capture')
 def capture():
@@ -258,44 +479,50 @@ def upload_photo():
         file_path = os.path.join(capture_dir, unique_filename)
         file.save(file_path)
         
-        # Processar imagem com face recognition
-        recognizer = FaceRecognizer()
-        result = recognizer.recognize_face_in_image(file_path)
+        # Processar imagem com o reconhecedor partilhado
+        recognizer.reload_if_changed()
+        faces, status = recognizer.recognize_faces_in_image(file_path, source='mobile_capture')
+        if not config.MULTI_FACE_ENABLED:
+            faces = faces[:1]
         
-        if result and len(result) >= 3:
-            detected_name, confidence, status = result[0], result[1], result[2]
-            
-            # Salvar detecção na base de dados
-            detection_id = save_detection_to_db(
-                image_path=os.path.join('captured_images', unique_filename),
-                detected_name=detected_name,
-                confidence=confidence,
+        image_path = os.path.join('captured_images', unique_filename)
+        
+        if not faces:
+            # Registar imagem sem faces para validação
+            save_detection_to_db(
+                image_path=image_path,
+                detected_name=None,
+                confidence=0.0,
                 source='mobile_capture'
             )
-            
-            if detected_name and detected_name != "Desconhecido":
-                detections = [{
-                    'name': detected_name,
-                    'confidence': confidence,
-                    'detection_id': detection_id
-                }]
-                return jsonify({
-                    'success': True,
-                    'detections': detections,
-                    'message': 'Face detectada com sucesso!'
-                })
-            else:
-                return jsonify({
-                    'success': True,
-                    'detections': [],
-                    'message': 'Nenhuma face conhecida detectada na imagem.'
-                })
-        else:
             return jsonify({
                 'success': True,
                 'detections': [],
                 'message': 'Nenhuma face detectada na imagem.'
             })
+        
+        # Salvar uma detecção por face numa única transação
+        detection_ids = recognizer.save_detections(image_path, faces, source='mobile_capture')
+        
+        detections = [{
+            'name': face['name'],
+            'confidence': face['confidence'],
+            'box': face['box'],
+            'detection_id': detection_id
+        } for face, detection_id in zip(faces, detection_ids) if face['name'] != "Desconhecido"]
+        
+        if detections:
+            return jsonify({
+                'success': True,
+                'detections': detections,
+                'message': 'Face detectada com sucesso!' if len(detections) == 1 else f'{len(detections)} faces detectadas com sucesso!'
+            })
+        else:
+            return jsonify({
+                'success': True,
+                'detections': [],
+                'message': 'Nenhuma face conhecida detectada na imagem.'
+            })
             
     except Exception as e:
         return jsonify({'success': False, 'error': f'Erro ao processar imagem: {str(e)}'}), 500
@@ -307,10 +534,7 @@ def allowed_file(filename):
 
 def save_detection_to_db(image_path, detected_name, confidence, source='file'):
     """Salvar detecção na base de dados"""
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
-    
-    try:
+    def insert(cursor):
         # Encontrar ID da pessoa detectada
         detected_person_id = None
         if detected_name and detected_name != "Desconhecido":
@@ -326,16 +550,13 @@ def save_detection_to_db(image_path, detected_name, confidence, source='file'):
             VALUES (?, ?, ?, ?, ?, ?, FALSE)
         """, (image_path, detected_name, detected_person_id, confidence, 
               datetime.now().isoformat(), source))
-        
-        detection_id = cursor.lastrowid
-        conn.commit()
-        return detection_id
-        
+        return cursor.lastrowid
+    
+    try:
+        return get_database().transaction(insert)
     except Exception as e:
         print(f"Erro ao salvar detecção: {e}")
         return None
-    finally:
-        conn.close()
 
 if __name__ == '__main__':
     # Print configuration